@@ -0,0 +1,283 @@
+"""
+Persistent fix log on the ESP32 filesystem, so rides are kept through WiFi outages and resets.
+
+Fixes are packed into a RAM buffer as 16 byte records and appended to the current log file a batch at a time:
+when the buffer holds a flash page, when FLUSH_INTERVAL_MS has passed since the last write, and on flush() before
+a reset. Files rotate at FILE_SIZE bytes and the oldest are deleted to keep at most FILE_COUNT, bounding the log
+to FILE_SIZE * FILE_COUNT bytes.
+
+Every write to a log file appends an entry to the file's index (NNNNNNNN.idx next to NNNNNNNN.bin): the time of
+the first record written and its offset in the log file, 8 bytes ("<II") per block. records() finds the first
+file and block of a time range from the first record of each file and a binary search of one index, seeks
+straight to it and stops at the first record past the range, so a query reads about as much as it returns.
+
+A record is little-endian ("<IiiHBB"):
+
+    offset  type    field
+    0       uint32  time, seconds since 2000-01-01 UTC (the MicroPython epoch) from the GPS date and time
+    4       int32   latitude, microdegrees
+    8       int32   longitude, microdegrees
+    12      uint16  velocity, hundredths of a mph
+    14      uint8   satellites in use
+    15      uint8   padding, always 0
+"""
+
+import os
+import ustruct
+import utime
+
+
+class LogConfig:
+    DIRECTORY = "/log"
+    PAGE_SIZE = 4096  # Flash erase block, the buffer is written when it holds this much
+    FLUSH_INTERVAL_MS = 60000  # Longest time a fix stays in RAM only
+    FILE_SIZE = 64 * 1024  # ~68 minutes at one fix per second
+    FILE_COUNT = 16
+
+
+# The pad byte is an explicit B: MicroPython's ustruct doesn't document the "x" pad code
+RECORD_FORMAT = "<IiiHBB"
+RECORD_SIZE = 16
+INDEX_FORMAT = "<II"
+INDEX_SIZE = 8
+# Bytes of a log file read at a time by records()
+READ_SIZE = 512
+
+
+def days_from_civil(year: int, month: int, day: int) -> int:
+    """Days since 2000-01-01 of a Gregorian date, integer math only"""
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 730425
+
+
+def gps_seconds(date, timestamp, local_offset: int) -> int:
+    """
+    Seconds since 2000-01-01 UTC for a MicropyGPS date (day, month, 2 digit year) and timestamp (hours shifted
+    by local_offset, minutes, seconds). 0 while the receiver hasn't reported a date.
+    """
+    day, month, year = date
+    if not day:
+        return 0
+    hours, minutes, seconds = timestamp
+    # The date is the UTC date, only the hours have the local offset applied
+    hours = (hours - local_offset) % 24
+    days = days_from_civil(2000 + year, month, day)
+    return days * 86400 + hours * 3600 + minutes * 60 + int(seconds)
+
+
+class FixLog:
+    def __init__(self, directory=None):
+        directory = directory or LogConfig.DIRECTORY
+        self._directory = directory
+        self._buffer = bytearray(LogConfig.PAGE_SIZE)
+        self._buffer_mv = memoryview(self._buffer)
+        self._fill = 0
+        self._read_buffer = bytearray(READ_SIZE)
+        self._read_buffer_mv = memoryview(self._read_buffer)
+        self._last_flush = utime.ticks_ms()
+        self.last_time = 0  # Time of the newest logged fix
+
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass  # Already exists
+
+        # Continue the newest file after a reset
+        self._files = self._log_files()
+        if self._files:
+            self._number = self._files[-1]
+            size = os.stat(self._path(self._number))[6]
+            whole = size - size % RECORD_SIZE
+            if whole:
+                with open(self._path(self._number), "rb") as log_file:
+                    log_file.seek(whole - RECORD_SIZE)
+                    self.last_time = ustruct.unpack("<I", log_file.read(4))[0]
+
+            self._size = size
+            if whole != size or self._index_size() % INDEX_SIZE:
+                # Cut short by a reset or power loss mid-write. Appending would misalign every later record,
+                # so the next flush starts a new file
+                self._size = LogConfig.FILE_SIZE
+        else:
+            self._number = 0
+            self._size = 0
+
+    def _path(self, number: int, extension: str = "bin") -> str:
+        return "%s/%08d.%s" % (self._directory, number, extension)
+
+    def _index_size(self) -> int:
+        try:
+            return os.stat(self._path(self._number, "idx"))[6]
+        except OSError:
+            return 0
+
+    def _log_files(self) -> list:
+        """Numbers of the log files, oldest first"""
+        return sorted(
+            int(name[:-4])
+            for name in os.listdir(self._directory)
+            if name.endswith(".bin")
+        )
+
+    def append(self, time, latitude, longitude, velocity, satellites):
+        """Buffer a fix, `time` from gps_seconds() and velocity in hundredths of a mph. Older times are ignored"""
+        if time <= self.last_time:
+            return
+        self.last_time = time
+
+        ustruct.pack_into(
+            RECORD_FORMAT,
+            self._buffer,
+            self._fill,
+            time,
+            latitude,
+            longitude,
+            velocity,
+            satellites,
+            0,
+        )
+        self._fill += RECORD_SIZE
+
+        if self._fill == len(self._buffer):
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """Write the buffered fixes if FLUSH_INTERVAL_MS has passed since the last write. Also called
+        periodically by GPSController, so fixes reach flash when no new ones arrive"""
+        if (
+            self._fill
+            and utime.ticks_diff(utime.ticks_ms(), self._last_flush)
+            >= LogConfig.FLUSH_INTERVAL_MS
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered fixes to flash"""
+        self._last_flush = utime.ticks_ms()
+        start = 0
+        try:
+            while start < self._fill:
+                if self._size >= LogConfig.FILE_SIZE:
+                    self._rotate()
+
+                end = min(self._fill, start + LogConfig.FILE_SIZE - self._size)
+                with open(self._path(self._number), "ab") as log_file:
+                    log_file.write(self._buffer_mv[start:end])
+                with open(self._path(self._number, "idx"), "ab") as index_file:
+                    first_time = ustruct.unpack_from("<I", self._buffer, start)[0]
+                    index_file.write(ustruct.pack(INDEX_FORMAT, first_time, self._size))
+                self._size += end - start
+                start = end
+        except OSError as e:
+            print(f"Fix log error: {e}")  # Filesystem full or failing, drop the batch
+            # The write may have been cut short, continue in a new file
+            self._size = LogConfig.FILE_SIZE
+        self._fill = 0
+
+    def _rotate(self):
+        """Start the next file, deleting the oldest ones past FILE_COUNT"""
+        if not self._files or self._files[-1] != self._number:
+            self._files.append(self._number)
+        self._number += 1
+        self._size = 0
+        self._files.append(self._number)
+
+        while len(self._files) > LogConfig.FILE_COUNT:
+            number = self._files.pop(0)
+            os.remove(self._path(number))
+            try:
+                os.remove(self._path(number, "idx"))
+            except OSError:
+                pass  # Written before indexes were added
+
+    def records(self, start, end):
+        """
+        Yield the logged records with start <= time <= end, oldest first, as memoryviews of up to READ_SIZE
+        bytes. Views of files share one buffer, so each must be written out before the generator is resumed.
+        Fixes logged while the records are being sent may be left out.
+        """
+        files = []
+        for number in self._log_files():
+            first_time = self._first_time(number)
+            if first_time is None:
+                continue
+            if first_time > end:
+                break
+            if first_time <= start:
+                files.clear()  # Older files end before the range starts
+            files.append(number)
+
+        newest = start - 1
+        for number in files:
+            for records in self._file_records(number, start, end):
+                newest = ustruct.unpack_from("<I", records, len(records) - RECORD_SIZE)[
+                    0
+                ]
+                yield records
+
+        # Fixes still in RAM, copied as the buffer is refilled after a flush
+        count = self._fill // RECORD_SIZE
+        low = _search(self._buffer, count, max(start, newest + 1))
+        high = _search(self._buffer, count, end + 1)
+        if low < high:
+            yield bytes(self._buffer_mv[low * RECORD_SIZE : high * RECORD_SIZE])
+
+    def _first_time(self, number: int):
+        """Time of the first record of a log file, None if it is empty"""
+        with open(self._path(number), "rb") as log_file:
+            data = log_file.read(4)
+        return ustruct.unpack("<I", data)[0] if len(data) == 4 else None
+
+    def _block_offset(self, number: int, start) -> int:
+        """Offset in a log file of the last block starting at or before `start`, from its index"""
+        try:
+            with open(self._path(number, "idx"), "rb") as index_file:
+                index = index_file.read()
+        except OSError:
+            return 0
+
+        offset = 0
+        low, high = 0, len(index) // INDEX_SIZE
+        while low < high:
+            middle = (low + high) // 2
+            first_time, block = ustruct.unpack_from(
+                INDEX_FORMAT, index, middle * INDEX_SIZE
+            )
+            if first_time <= start:
+                offset = block
+                low = middle + 1
+            else:
+                high = middle
+        return offset
+
+    def _file_records(self, number: int, start, end):
+        with open(self._path(number), "rb") as log_file:
+            log_file.seek(self._block_offset(number, start))
+            while True:
+                count = log_file.readinto(self._read_buffer) // RECORD_SIZE
+                if not count:
+                    return
+                low = _search(self._read_buffer, count, start)
+                high = _search(self._read_buffer, count, end + 1)
+                if low < high:
+                    yield self._read_buffer_mv[low * RECORD_SIZE : high * RECORD_SIZE]
+                if high < count:
+                    return  # Past the end of the range
+
+
+def _search(records, count: int, time) -> int:
+    """Index of the first of `count` records in `records` with a time of at least `time`"""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if ustruct.unpack_from("<I", records, middle * RECORD_SIZE)[0] < time:
+            low = middle + 1
+        else:
+            high = middle
+    return low
@@ -1,6 +1,12 @@
+import _thread
 import machine
+import math
 import uasyncio
+import utime
+from array import array
 from libraries.micropyGPS import MicropyGPS
+from fix_log import FixLog, LogConfig, gps_seconds
+import receiver_config
 
 
 class GPSConfig:
@@ -10,6 +16,101 @@ class GPSConfig:
     RX_PIN = 16
     LOCAL_OFFSET = -5  # EST
     RX_BUF = 1024
+    # Receiver command set ("mtk" or "ubx", see receiver_config.py) to configure the receiver at startup
+    # with, None leaves it at its defaults
+    RECEIVER = None
+    # Baud rate and fixes per second the receiver is switched to, 5-10 Hz need 115200 baud
+    RECEIVER_BAUDRATE = 115200
+    RATE_HZ = 5
+    # Reads wait for at least MIN_CHUNK bytes, or READ_DEADLINE_MS after the first byte arrives, so the
+    # parser runs a few times per epoch instead of once per byte
+    MIN_CHUNK = 128
+    READ_DEADLINE_MS = 20
+    # Sentence types parsed by MicropyGPS, everything else is dropped after its type is read.
+    # RMC: position, speed and date; GGA: position and satellites in use
+    SENTENCES = ("RMC", "GGA")
+    # Fixes kept in the track history ring buffer (10 minutes at 1 Hz, 2 at 5 Hz, ~9 KB)
+    TRACK_SIZE = 600
+    # Keep a persistent log of fixes (one per second) on flash, see fix_log.py
+    LOG = True
+    # Most fixes queued for a subscriber before the oldest are dropped
+    FIX_QUEUE = 4
+    # Incomplete epochs in a row after which the expected sentence types are learned again
+    EPOCH_MISSES = 3
+    # Read and parse the UART on a _thread worker instead of the asyncio loop, see run()
+    THREADED = False
+
+
+# Bits of the sentence types carrying the UTC time, which group sentences into epochs
+EPOCH_BITS = {"RMC": 1, "GGA": 2, "GLL": 4}
+
+
+def format_microdegrees(value: int) -> str:
+    """Decimal degrees text for a signed microdegree value, e.g. -71042000 -> "-71.042000" """
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    return f"{sign}{value // 1000000}.{value % 1000000:06d}"
+
+
+class Fix:
+    """
+    A published fix. Positions are signed integer microdegrees (see format_microdegrees()), velocity is in
+    hundredths of a mph and timestamp is the ticks_ms() fix time.
+
+    GPSController publishes into a few preallocated records in turn instead of allocating one per fix, so a
+    record is only valid until FIX_QUEUE more fixes have been published. MicroPython ignores __slots__, it
+    keeps the records small on the host.
+    """
+
+    __slots__ = ("latitude", "longitude", "velocity", "satellites", "timestamp")
+
+    def __init__(self):
+        self.latitude = 0
+        self.longitude = 0
+        self.velocity = 0
+        self.satellites = 0
+        self.timestamp = 0
+
+
+class FixSubscription:
+    """
+    Fixes published by a GPSController for one subscriber, see GPSController.fixes(). Holds up to `size` fixes,
+    dropping the oldest (counted in `dropped`) when the subscriber falls behind.
+    """
+
+    def __init__(self, controller, size: int):
+        self._controller = controller
+        self._size = size
+        self._queue = []
+        self._event = uasyncio.Event()
+        self.dropped = 0
+
+    def _put(self, fix: Fix):
+        if len(self._queue) >= self._size:
+            self._queue.pop(0)
+            self.dropped += 1
+        self._queue.append(fix)
+        self._event.set()
+
+    def close(self):
+        """Stop receiving fixes"""
+        if self in self._controller._subscribers:
+            self._controller._subscribers.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Fix:
+        while not self._queue:
+            self._event.clear()
+            await self._event.wait()
+        return self._queue.pop(0)
 
 
 class GPSController:
@@ -24,53 +125,342 @@ class GPSController:
 
         # Initialize the asyncio StreamReader wrapping the UART
         self._sreader = uasyncio.StreamReader(self._uart)  # type:ignore
+        self._baudrate = GPSConfig.BAUDRATE
 
         self._gps = MicropyGPS(
-            local_offset=GPSConfig.LOCAL_OFFSET, location_formatting="dd"
+            local_offset=GPSConfig.LOCAL_OFFSET,
+            location_formatting="udeg",
+            sentence_filter=GPSConfig.SENTENCES,
+            sentence_callback=self._on_sentence,
         )
 
-        self._state = {
-            "latitude": 0.0,
-            "longitude": 0.0,
-            "velocity": 0.0,
-            "satellites": 0,
-            "timestamp": 0,
-        }
+        # Records the fixes are published into in turn, one more than a subscriber can have queued so the
+        # fix it is handling is not overwritten either
+        self._fixes = [Fix() for _ in range(GPSConfig.FIX_QUEUE + 1)]
+        self._state = self._fixes[0]
+
+        # Track history ring buffer, stored as parallel columns so a fix costs 15 bytes and no allocation.
+        # Velocity is in hundredths of a mph, timestamps are the ticks_ms() fix times.
+        self._track_lat = array("i", [0] * GPSConfig.TRACK_SIZE)
+        self._track_lon = array("i", [0] * GPSConfig.TRACK_SIZE)
+        self._track_vel = array("H", [0] * GPSConfig.TRACK_SIZE)
+        self._track_sats = array("B", [0] * GPSConfig.TRACK_SIZE)
+        self._track_ticks = array("I", [0] * GPSConfig.TRACK_SIZE)
+        self._track_head = 0  # Slot the next fix is written to
+        self._track_len = 0
+
+        self.log = FixLog() if GPSConfig.LOG else None
+
+        # Incremented on every state update so consumers can cache anything derived from a fix
+        self.version = 0
+
+        # Subscriptions each new state is queued to, see fixes()
+        self._subscribers = []
+
+        # The receiver sends several sentences per fix (an epoch) with the same UTC time. The state is
+        # published once the sentence types expected in an epoch have all arrived, and the expected types are
+        # learned from the epochs received, see _on_sentence()
+        self._epoch_time = -1
+        self._epoch_mask = 0
+        self._epoch_expected = 0
+        self._epoch_misses = 0
+        self._epoch_published = False
+
+        # Completed epochs as (latitude, longitude, velocity, satellites, timestamp, log time), written by the
+        # parser into the back buffer and copied to the front one to be published, see _update_state(). In
+        # threaded mode the back buffer is shared with the worker and guarded by _epoch_lock.
+        self._back = array("i", [0] * 6)
+        self._front = array("i", [0] * 6)
+        self._epoch_lock = _thread.allocate_lock()
+        self._epoch_ready = None  # ThreadSafeFlag set by the worker, created by run()
+        self._threaded = False
+        self._worker_running = False
+
+    def _record_fix(self, fix: Fix):
+        """Append a fix to the track history, overwriting the oldest once the buffer is full"""
+        head = self._track_head
+        self._track_lat[head] = fix.latitude
+        self._track_lon[head] = fix.longitude
+        self._track_vel[head] = fix.velocity
+        self._track_sats[head] = fix.satellites
+        self._track_ticks[head] = fix.timestamp
+
+        self._track_head = (head + 1) % GPSConfig.TRACK_SIZE
+        if self._track_len < GPSConfig.TRACK_SIZE:
+            self._track_len += 1
+
+    def track_since(self, since=None, tolerance=0):
+        """
+        Yields the recorded fixes newer than the `since` fix time (all of them if None), oldest first. The same
+        Fix is updated and yielded for every fix, so its fields must be used before the next one.
+
+        With a `tolerance` in metres, fixes closer than that to the last yielded fix are skipped (radial distance
+        simplification), the newest fix is always yielded.
+        """
+        size = GPSConfig.TRACK_SIZE
+        slot = (self._track_head - self._track_len) % size
+        newest = self._track_len - 1
+
+        # Tolerance in microdegrees of latitude. Longitude differences are scaled by cos(latitude), as a
+        # fraction of 1024, once the first fix is known
+        tolerance = tolerance * 1000000 // 111320
+        tolerance_sq = tolerance * tolerance
+        lon_scale = 0
+        last_lat = last_lon = 0
+        fix = Fix()
+
+        for index in range(self._track_len):
+            timestamp = self._track_ticks[slot]
+            # ticks_diff() keeps the comparison correct across the ticks_ms() wrap-around
+            if since is None or utime.ticks_diff(timestamp, since) > 0:
+                latitude = self._track_lat[slot]
+                longitude = self._track_lon[slot]
+
+                near = False
+                if lon_scale and index != newest:
+                    d_lat = abs(latitude - last_lat)
+                    d_lon = abs(longitude - last_lon) * lon_scale >> 10
+                    # Squares only computed for nearby fixes, so they stay small ints
+                    near = (
+                        d_lat < tolerance
+                        and d_lon < tolerance
+                        and d_lat * d_lat + d_lon * d_lon < tolerance_sq
+                    )
+
+                if not near:
+                    if tolerance and not lon_scale:
+                        lon_scale = max(
+                            int(math.cos(math.radians(latitude / 1000000)) * 1024), 1
+                        )
+                    last_lat, last_lon = latitude, longitude
+                    fix.latitude = latitude
+                    fix.longitude = longitude
+                    fix.velocity = self._track_vel[slot]
+                    fix.satellites = self._track_sats[slot]
+                    fix.timestamp = timestamp
+                    yield fix
+            slot = (slot + 1) % size
+
+    def _on_sentence(self, sentence_type: str):
+        """Called by MicropyGPS for every parsed sentence, publishes the state when an epoch is complete"""
+        bit = EPOCH_BITS.get(sentence_type[2:])
+        if not bit:
+            return  # No time, so its data is published with the epoch in progress
+
+        hours, minutes, seconds = self._gps.timestamp
+        epoch_time = (hours * 60 + minutes) * 6000 + int(seconds * 100)
+        # A type seen again also starts a new epoch: before the receiver has the time, every sentence has
+        # an empty time field and the same epoch_time
+        if epoch_time != self._epoch_time or self._epoch_mask & bit:
+            self._end_epoch()
+            self._epoch_time = epoch_time
+
+        self._epoch_mask |= bit
+        expected = self._epoch_expected
+        if (
+            expected
+            and not self._epoch_published
+            and self._epoch_mask & expected == expected
+        ):
+            self._epoch_published = True
+            self._update_state()
+
+    def _end_epoch(self):
+        """Learn the expected sentence types from the epoch that just ended. Incomplete epochs are dropped"""
+        mask = self._epoch_mask
+        expected = self._epoch_expected
+        if not expected or mask & expected == expected:
+            # First epoch, or a complete one which may have more types than expected (the first epoch
+            # received is usually cut short)
+            self._epoch_expected = mask
+            self._epoch_misses = 0
+        elif mask:
+            self._epoch_misses += 1
+            if self._epoch_misses >= GPSConfig.EPOCH_MISSES:
+                # The receiver's output changed
+                self._epoch_expected = mask
+                self._epoch_misses = 0
+
+        self._epoch_mask = 0
+        self._epoch_published = False
 
     def _update_state(self):
+        """Hand the completed epoch to _publish(), through the worker's flag in threaded mode"""
+        if self._threaded:
+            with self._epoch_lock:
+                self._read_epoch(self._back)
+            self._epoch_ready.set()
+        else:
+            self._read_epoch(self._front)
+            self._publish(self._front)
+
+    def _read_epoch(self, epoch):
         lat_val, lat_dir = self._gps.latitude
         lon_val, lon_dir = self._gps.longitude
 
-        latitude: float = lat_val if lat_dir == "N" else -lat_val
-        longitude: float = lon_val if lon_dir == "E" else -lon_val
-
         timestamp = self._gps.fix_time
         if not isinstance(timestamp, int):
             timestamp = 0
 
-        self._state = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "velocity": self._gps.speed[1],
-            "satellites": self._gps.satellites_in_use,
-            "timestamp": timestamp,
-        }
+        epoch[0] = lat_val if lat_dir == "N" else -lat_val
+        epoch[1] = lon_val if lon_dir == "E" else -lon_val
+        epoch[2] = min(int(self._gps.speed[1] * 100 + 0.5), 0xFFFF)
+        epoch[3] = self._gps.satellites_in_use
+        epoch[4] = timestamp
+        epoch[5] = gps_seconds(
+            self._gps.date, self._gps.timestamp, self._gps.local_offset
+        )
+
+    def _publish(self, epoch):
+        latitude = epoch[0]
+        longitude = epoch[1]
+        timestamp = epoch[4]
+
+        # Written in place, see Fix
+        fix = self._fixes[(self.version + 1) % len(self._fixes)]
+        fix.latitude = latitude
+        fix.longitude = longitude
+        fix.velocity = epoch[2]
+        fix.satellites = epoch[3]
+        fix.timestamp = timestamp
+        self._state = fix
 
-    def get_data(self):
+        if timestamp and (latitude or longitude):
+            self._record_fix(fix)
+
+            if self.log and epoch[5]:
+                self.log.append(
+                    epoch[5], latitude, longitude, fix.velocity, fix.satellites
+                )
+
+        self.version += 1
+
+        for subscriber in self._subscribers:
+            subscriber._put(fix)
+
+    def flush_log(self):
+        """Write buffered log fixes to flash, called before a reset"""
+        if self.log:
+            self.log.flush()
+
+    async def _flush_log_when_due(self):
+        """Flush the log on time when fixes stop (fix lost, ride ended), append() only checks on a new fix"""
+        while True:
+            await uasyncio.sleep_ms(LogConfig.FLUSH_INTERVAL_MS // 10)
+            self.log.flush_if_due()
+
+    def get_data(self) -> Fix:
+        """The latest fix, valid until FIX_QUEUE more fixes have been published"""
         return self._state
 
+    def fixes(self, size: int = GPSConfig.FIX_QUEUE) -> FixSubscription:
+        """
+        Subscribe to state updates, each new fix is queued to the subscription as it is published:
+
+            with controller.fixes() as fixes:
+                async for fix in fixes:
+                    ...
+
+        Leaving the `with` block (or calling close()) unsubscribes. At most FIX_QUEUE fixes are queued, see Fix.
+        """
+        subscription = FixSubscription(self, min(size, GPSConfig.FIX_QUEUE))
+        self._subscribers.append(subscription)
+        return subscription
+
+    async def configure_receiver(self):
+        """
+        Send GPSConfig.RECEIVER's commands for the parsed sentences and RATE_HZ, then switch the receiver and
+        the UART to RECEIVER_BAUDRATE. The settings are sent at both baud rates, as after a reset of the ESP32
+        alone the receiver is still at the new one.
+        """
+        commands = receiver_config.RECEIVERS[GPSConfig.RECEIVER]
+        baudrate = GPSConfig.RECEIVER_BAUDRATE
+        if baudrate == self._baudrate:
+            baudrate = 0
+
+        sent = 0
+        for command in commands(GPSConfig.SENTENCES, GPSConfig.RATE_HZ, baudrate):
+            sent += self._uart.write(command)
+        if not baudrate:
+            return
+
+        # Let the commands go out before the UART changes speed, 10 bits per byte
+        await uasyncio.sleep_ms(sent * 10000 // self._baudrate + 100)
+        self._uart.init(baudrate=baudrate)
+        self._baudrate = baudrate
+
+        for command in commands(GPSConfig.SENTENCES, GPSConfig.RATE_HZ):
+            self._uart.write(command)
+
+    async def _parse_rest(self, count: int):
+        """
+        Parse the rest of a chunk whose first `count` bytes were already parsed, once up to MIN_CHUNK bytes
+        have accumulated or READ_DEADLINE_MS has passed. The UART's bytes are parsed as read, without a copy.
+        """
+        # Time for the rest of the chunk to arrive at 10 bits per byte, capped by the deadline
+        wait = (GPSConfig.MIN_CHUNK - count) * 10000 // self._baudrate + 1
+        await uasyncio.sleep_ms(min(wait, GPSConfig.READ_DEADLINE_MS))
+        data = self._uart.read()
+        if data:
+            self._gps.update_bytes(data)
+
+    def _parse_worker(self):
+        """Threaded mode: read and parse the UART until run() is cancelled, batching reads like run()"""
+        while self._worker_running:
+            try:
+                if self._uart.any() < GPSConfig.MIN_CHUNK:
+                    utime.sleep_ms(GPSConfig.READ_DEADLINE_MS)
+                data = self._uart.read()
+                if data:
+                    self._gps.update_bytes(data)
+
+            except UnicodeError:
+                pass
+            except Exception as e:
+                print(f"GPS Error: {e}")
+                utime.sleep_ms(1000)
+
+    async def _run_threaded(self):
+        """
+        Parse on a _thread worker and publish the epochs it completes here, so long parses (GSV bursts) and
+        slow HTTP clients don't hold each other up. If epochs complete faster than they are published, only
+        the newest is.
+        """
+        self._epoch_ready = uasyncio.ThreadSafeFlag()
+        self._threaded = True
+        self._worker_running = True
+        _thread.start_new_thread(self._parse_worker, ())
+        try:
+            while True:
+                await self._epoch_ready.wait()
+                with self._epoch_lock:
+                    self._front[:] = self._back
+                try:
+                    self._publish(self._front)
+                except Exception as e:
+                    print(f"GPS Error: {e}")
+                    await uasyncio.sleep(1)
+        finally:
+            self._worker_running = False
+
     async def run(self):
         print("GPS Controller Started...")
+        if GPSConfig.RECEIVER:
+            await self.configure_receiver()
+        if self.log:
+            uasyncio.create_task(self._flush_log_when_due())
+        if GPSConfig.THREADED:
+            await self._run_threaded()
 
         while True:
             try:
                 # Yields to the scheduler until at least 1 byte is available
                 data = await self._sreader.read(GPSConfig.RX_BUF)
 
-                for byte in data:
-                    stat = self._gps.update(chr(byte))
-                    if stat:
-                        self._update_state()
+                # Complete epochs are published from _on_sentence()
+                self._gps.update_bytes(data)
+                if len(data) < GPSConfig.MIN_CHUNK:
+                    await self._parse_rest(len(data))
 
             except UnicodeError:
                 pass
@@ -83,10 +473,11 @@ async def run_gps():
     gps = GPSController()
     uasyncio.create_task(gps.run())
 
-    while True:
-        print(gps.get_data())
-
-        await uasyncio.sleep(1)
+    with gps.fixes() as fixes:
+        async for fix in fixes:
+            print(
+                fix.latitude, fix.longitude, fix.velocity, fix.satellites, fix.timestamp
+            )
 
 
 if __name__ == "__main__":
@@ -8,8 +8,8 @@
 # Time Since First Fix
 # Distance/Time to Target
 # More Helper Functions
-# Dynamically limit sentences types to parse
 
+from array import array
 from math import floor, modf
 
 # Import utime or time for fix time handling
@@ -22,9 +22,60 @@ except ImportError:
     import time
 
 
+# Value of each ASCII hex digit, 0xFF for every other byte
+_HEX_NIBBLES = bytearray(b"\xff" * 256)
+for _value, _digit in enumerate(b"0123456789ABCDEF"):
+    _HEX_NIBBLES[_digit] = _value
+for _value, _digit in enumerate(b"abcdef", 10):
+    _HEX_NIBBLES[_digit] = _value
+_HEX_NIBBLES = bytes(_HEX_NIBBLES)
+del _value, _digit
+
+
+def nmea_crc_valid(sentence, star):
+    """Checks the XOR checksum of a complete sentence in one pass. sentence is a memoryview (or any buffer) of the
+    sentence without its leading '$', with the '*' at index star followed by the two hex CRC characters.
+    Returns True if the CRC characters are well formed and match the data"""
+    if len(sentence) < star + 3:
+        return False
+
+    high = _HEX_NIBBLES[sentence[star + 1]]
+    low = _HEX_NIBBLES[sentence[star + 2]]
+    if high > 15 or low > 15:
+        return False  # CRC Value was deformed and could not have been correct
+
+    crc_xor = 0
+    for char in sentence[:star]:
+        crc_xor ^= char
+
+    return crc_xor == (high << 4) | low
+
+
+class _SentenceFields(object):
+    """Read only view of the fields of the sentence held in a MicropyGPS sentence buffer. Stands in for the
+    gps_segments list during update_bytes(); a field string is only created when a sentence parser indexes it"""
+
+    def __init__(self, gps):
+        self._gps = gps
+
+    def __len__(self):
+        return self._gps._field_count
+
+    def __getitem__(self, index):
+        gps = self._gps
+        count = gps._field_count
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("field index out of range")
+
+        start = gps._field_ends[index - 1] + 1 if index else 0
+        return str(gps._sentence_mv[start : gps._field_ends[index]], "ascii")
+
+
 class MicropyGPS(object):
     """GPS NMEA Sentence Parser. Creates object that stores all relevant GPS data and statistics.
-    Parses sentences one character at a time using update()."""
+    Parses sentences one character at a time using update(), or a whole chunk of raw bytes using update_bytes()."""
 
     # Max Number of Characters a valid sentence can be (based on GGA sentence)
     SENTENCE_LIMIT = 90
@@ -65,7 +116,13 @@ class MicropyGPS(object):
         "December",
     )
 
-    def __init__(self, local_offset=0, location_formatting="ddm"):
+    def __init__(
+        self,
+        local_offset=0,
+        location_formatting="ddm",
+        sentence_filter=None,
+        sentence_callback=None,
+    ):
         """
         Setup GPS Object Status Flags, Internal Data Registers, etc
             local_offset (int): Timzone Difference to UTC
@@ -73,6 +130,11 @@ class MicropyGPS(object):
                                        Decimal Degree Minute (ddm) - 40° 26.767′ N
                                        Degrees Minutes Seconds (dms) - 40° 26′ 46″ N
                                        Decimal Degrees (dd) - 40.446° N
+                                       Integer Microdegrees (udeg) - 40446117 N
+            sentence_filter (iterable): Sentence types to parse, see set_sentence_filter(). None parses all
+                                        supported sentences
+            sentence_callback (callable): Called with the sentence type after update_bytes() parses each
+                                          sentence, while the object's data is that of the sentence
         """
 
         #####################
@@ -85,6 +147,23 @@ class MicropyGPS(object):
         self.char_count = 0
         self.fix_time = 0
 
+        #####################
+        # Buffered Sentence Assembly (update_bytes)
+        # Fixed size buffers reused for every sentence so segmentation never allocates
+        self._sentence = bytearray(self.SENTENCE_LIMIT)
+        self._sentence_mv = memoryview(self._sentence)
+        self._field_ends = array("H", [0] * (self.SENTENCE_LIMIT + 2))
+        self._fields = _SentenceFields(self)
+        self._fill = -1  # Bytes held in the sentence buffer, -1 while waiting for a '$'
+        self._star = -1  # Position of '*' in the sentence buffer, -1 until received
+        self._field_count = 0
+
+        #####################
+        # Sentence Types to Parse
+        self._parsers = self.supported_sentences
+        self.set_sentence_filter(sentence_filter)
+        self.sentence_callback = sentence_callback
+
         #####################
         # Sentence Statistics
         self.crc_fails = 0
@@ -135,6 +214,8 @@ class MicropyGPS(object):
         if self.coord_format == "dd":
             decimal_degrees = self._latitude[0] + (self._latitude[1] / 60)
             return [decimal_degrees, self._latitude[2]]
+        elif self.coord_format == "udeg":
+            return [self._latitude[0], self._latitude[2]]
         elif self.coord_format == "dms":
             minute_parts = modf(self._latitude[1])
             seconds = round(minute_parts[0] * 60)
@@ -148,6 +229,8 @@ class MicropyGPS(object):
         if self.coord_format == "dd":
             decimal_degrees = self._longitude[0] + (self._longitude[1] / 60)
             return [decimal_degrees, self._longitude[2]]
+        elif self.coord_format == "udeg":
+            return [self._longitude[0], self._longitude[2]]
         elif self.coord_format == "dms":
             minute_parts = modf(self._longitude[1])
             seconds = round(minute_parts[0] * 60)
@@ -160,6 +243,45 @@ class MicropyGPS(object):
         else:
             return self._longitude
 
+    def _coordinate(self, l_string, degree_digits):
+        """Split a NMEA ddmm.mmmm / dddmm.mmmm field into (degrees, minutes). With "udeg" formatting the whole
+        value is instead converted to integer microdegrees using integer arithmetic only and returned as
+        (microdegrees, 0), keeping floats out of the position pipeline"""
+        degrees = int(l_string[0:degree_digits])
+        if self.coord_format != "udeg":
+            return degrees, float(l_string[degree_digits:])
+
+        dot = l_string.find(".")
+        if dot < 0:
+            whole = l_string[degree_digits:]
+            fraction = ""
+        else:
+            whole = l_string[degree_digits:dot]
+            fraction = l_string[dot + 1 : dot + 6]
+
+        # Minutes in units of 1e-5', then rounded to 1e-6°. Stays within MicroPython's small int range.
+        minutes = int(whole) * 100000 + int((fraction + "00000")[:5])
+        return degrees * 1000000 + (minutes * 10 + 30) // 60, 0
+
+    ########################################
+    # Sentence Filtering
+    ########################################
+    def set_sentence_filter(self, sentence_types=None):
+        """
+        Limit parsing to the given sentence types. Entries are either full types ('GNRMC') or three letter
+        types matching any talker ('RMC'). Other sentences are dropped as soon as their type has been read,
+        before any CRC or field processing. None restores parsing of every supported sentence
+        """
+        if sentence_types is None:
+            self._parsers = self.supported_sentences
+            return
+
+        self._parsers = {
+            sentence: parser
+            for sentence, parser in self.supported_sentences.items()
+            if sentence in sentence_types or sentence[2:] in sentence_types
+        }
+
     ########################################
     # Logging Related Functions
     ########################################
@@ -246,14 +368,12 @@ class MicropyGPS(object):
             try:
                 # Latitude
                 l_string = self.gps_segments[3]
-                lat_degs = int(l_string[0:2])
-                lat_mins = float(l_string[2:])
+                lat_degs, lat_mins = self._coordinate(l_string, 2)
                 lat_hemi = self.gps_segments[4]
 
                 # Longitude
                 l_string = self.gps_segments[5]
-                lon_degs = int(l_string[0:3])
-                lon_mins = float(l_string[3:])
+                lon_degs, lon_mins = self._coordinate(l_string, 3)
                 lon_hemi = self.gps_segments[6]
             except ValueError:
                 return False
@@ -326,14 +446,12 @@ class MicropyGPS(object):
             try:
                 # Latitude
                 l_string = self.gps_segments[1]
-                lat_degs = int(l_string[0:2])
-                lat_mins = float(l_string[2:])
+                lat_degs, lat_mins = self._coordinate(l_string, 2)
                 lat_hemi = self.gps_segments[2]
 
                 # Longitude
                 l_string = self.gps_segments[3]
-                lon_degs = int(l_string[0:3])
-                lon_mins = float(l_string[3:])
+                lon_degs, lon_mins = self._coordinate(l_string, 3)
                 lon_hemi = self.gps_segments[4]
             except ValueError:
                 return False
@@ -411,14 +529,12 @@ class MicropyGPS(object):
             try:
                 # Latitude
                 l_string = self.gps_segments[2]
-                lat_degs = int(l_string[0:2])
-                lat_mins = float(l_string[2:])
+                lat_degs, lat_mins = self._coordinate(l_string, 2)
                 lat_hemi = self.gps_segments[3]
 
                 # Longitude
                 l_string = self.gps_segments[4]
-                lon_degs = int(l_string[0:3])
-                lon_mins = float(l_string[3:])
+                lon_degs, lon_mins = self._coordinate(l_string, 3)
                 lon_hemi = self.gps_segments[5]
             except ValueError:
                 return False
@@ -612,6 +728,14 @@ class MicropyGPS(object):
                 # Check if a section is ended (,), Create a new substring to feed
                 # characters to
                 elif new_char == ",":
+                    # Drop filtered sentence types once their type has been read
+                    if (
+                        self.active_segment == 0
+                        and self.gps_segments[0] not in self._parsers
+                    ):
+                        self.sentence_active = False
+                        return None
+
                     self.active_segment += 1
                     self.gps_segments.append("")
 
@@ -642,9 +766,9 @@ class MicropyGPS(object):
                     self.clean_sentences += 1  # Increment clean sentences received
                     self.sentence_active = False  # Clear Active Processing Flag
 
-                    if self.gps_segments[0] in self.supported_sentences:
+                    if self.gps_segments[0] in self._parsers:
                         # parse the Sentence Based on the message type, return True if parse is clean
-                        if self.supported_sentences[self.gps_segments[0]](self):
+                        if self._parsers[self.gps_segments[0]](self):
                             # Let host know that the GPS object was updated by returning parsed sentence type
                             self.parsed_sentences += 1
                             return self.gps_segments[0]
@@ -656,6 +780,141 @@ class MicropyGPS(object):
         # Tell Host no new sentence was parsed
         return None
 
+    def update_bytes(self, buf):
+        """Process a chunk of raw bytes as read from the receiver. Sentence boundaries ('$', '*') and field
+        separators (',') are located by searching the chunk instead of feeding characters one at a time through
+        update(). Sentence bytes are copied into a preallocated buffer and only field offsets are recorded; field
+        strings are created when a sentence parser reads them. A sentence cut off at the end of the chunk is
+        completed by the next call. bytearray and memoryview chunks are copied to bytes first. Returns a list of
+        the sentence types successfully parsed from the chunk"""
+
+        parsed = []
+
+        if not isinstance(buf, bytes):
+            buf = bytes(buf)
+        buf_mv = memoryview(buf)
+        end = len(buf)
+        pos = 0
+
+        while pos < end:
+            # Wait for a new sentence to start ($)
+            if self._fill < 0:
+                start = buf.find(b"$", pos)
+                if start < 0:
+                    break
+                self._fill = 0
+                self._star = -1
+                self._field_count = 0
+                pos = start + 1
+
+            # Copy sentence data up to and including the '*', or the rest of the chunk
+            if self._star < 0:
+                star = buf.find(b"*", pos)
+                stop = end if star < 0 else star + 1
+            # Copy the two CRC characters following the '*'
+            else:
+                star = -1
+                stop = min(end, pos + self._star + 3 - self._fill)
+
+            # A new '$' means the current sentence was cut short, start over from there
+            restart = buf.find(b"$", pos, stop)
+            if restart >= 0:
+                self._fill = -1
+                pos = restart
+                continue
+
+            if not self._buffer_sentence_data(buf, buf_mv, pos, stop):
+                # Too long to be a valid sentence, drop it
+                self._fill = -1
+                pos = stop
+                continue
+            pos = stop
+
+            if star >= 0:
+                self._star = self._fill - 1
+                self._field_ends[self._field_count] = self._star
+                self._field_count += 1
+
+            elif self._star >= 0 and self._fill == self._star + 3:
+                self._field_ends[self._field_count] = self._fill
+                self._field_count += 1
+                self._fill = -1
+
+                sentence_type = self._parse_buffered_sentence()
+                if sentence_type:
+                    parsed.append(sentence_type)
+                    if self.sentence_callback:
+                        self.sentence_callback(sentence_type)
+
+        return parsed
+
+    # Bulk parsing alias, reads naturally when handing over a UART buffer
+    feed = update_bytes
+
+    def _buffer_sentence_data(self, buf, buf_mv, start, stop):
+        """Append buf[start:stop] to the sentence buffer and record the position of each ',' found in it.
+        Returns False if the sentence no longer fits in SENTENCE_LIMIT or its type is filtered out"""
+        fill = self._fill
+        count = stop - start
+        if fill + count > self.SENTENCE_LIMIT:
+            return False
+
+        self._sentence_mv[fill : fill + count] = buf_mv[start:stop]
+
+        offset = fill - start
+        comma = buf.find(b",", start, stop)
+        while comma >= 0:
+            self._field_ends[self._field_count] = comma + offset
+            self._field_count += 1
+
+            # The type is known once the first field ends, skip the rest of unwanted sentences
+            if self._field_count == 1:
+                try:
+                    sentence_type = self._fields[0]
+                except UnicodeError:
+                    return False  # Line noise (a non-ASCII byte) in the type
+                if sentence_type not in self._parsers:
+                    return False
+
+            comma = buf.find(b",", comma + 1, stop)
+
+        self._fill = fill + count
+        return True
+
+    def _parse_buffered_sentence(self):
+        """Validate and parse the sentence held in the sentence buffer. Returns sentence type on successful
+        parse, None otherwise"""
+        try:
+            return self._parse_buffered_fields()
+        except UnicodeError:
+            # A non-ASCII byte in a field, line noise the CRC may not have caught. Only this sentence is dropped
+            return None
+
+    def _parse_buffered_fields(self):
+        # Reject unsupported sentence types first, it costs a single short string and no CRC pass
+        sentence_type = self._fields[0]
+        if sentence_type not in self._parsers:
+            return None
+
+        if not nmea_crc_valid(self._sentence_mv, self._star):
+            self.crc_fails += 1
+            return None
+
+        self.clean_sentences += 1
+
+        if self.log_en:
+            self.write_log(
+                "$" + str(self._sentence_mv[: self._star + 3], "ascii") + "\n"
+            )
+
+        # parse the Sentence Based on the message type, return True if parse is clean
+        self.gps_segments = self._fields
+        if self._parsers[sentence_type](self):
+            self.parsed_sentences += 1
+            return sentence_type
+
+        return None
+
     def new_fix_time(self):
         """Updates a high resolution counter with current time when fix is updated. Currently only triggered from
         GGA, GSA and RMC sentences"""
@@ -738,6 +997,12 @@ class MicropyGPS(object):
         if self.coord_format == "dd":
             formatted_latitude = self.latitude
             lat_string = str(formatted_latitude[0]) + "° " + str(self._latitude[2])
+        elif self.coord_format == "udeg":
+            lat_string = "%d.%06d° %s" % (
+                self._latitude[0] // 1000000,
+                self._latitude[0] % 1000000,
+                self._latitude[2],
+            )
         elif self.coord_format == "dms":
             formatted_latitude = self.latitude
             lat_string = (
@@ -767,6 +1032,12 @@ class MicropyGPS(object):
         if self.coord_format == "dd":
             formatted_longitude = self.longitude
             lon_string = str(formatted_longitude[0]) + "° " + str(self._longitude[2])
+        elif self.coord_format == "udeg":
+            lon_string = "%d.%06d° %s" % (
+                self._longitude[0] // 1000000,
+                self._longitude[0] % 1000000,
+                self._longitude[2],
+            )
         elif self.coord_format == "dms":
             formatted_longitude = self.longitude
             lon_string = (
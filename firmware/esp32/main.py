@@ -2,10 +2,12 @@ import machine
 import network
 import uasyncio
 from uasyncio import StreamReader, StreamWriter
-import ujson
 import gc
-from gps_controller import GPSController
+from gps_controller import GPSController, format_microdegrees
+import wire_format
+import fix_log
 import time
+import ustruct
 
 ENV_PATH = ".env"
 
@@ -35,6 +37,78 @@ PORT = int(PORT)
 
 gps_controller = GPSController()
 
+FIX_JSON = '{"latitude": %s, "longitude": %s, "velocity": %s, "satellites": %d, "timestamp": %d}'
+LOG_FIX_JSON = '{"latitude": %s, "longitude": %s, "velocity": %d.%02d, "satellites": %d, "time": %d}'
+
+# Seconds from the unix epoch to the MicroPython epoch (2000-01-01) the fix log's times count from
+UNIX_EPOCH_OFFSET = 946684800
+
+# Standard CORS headers required for ALL responses
+CORS_HEADERS = (
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+    b"Access-Control-Allow-Headers: *\r\n"
+)
+
+# Persistent connections: idle keep-alive sockets are closed after IDLE_TIMEOUT seconds, and connections
+# beyond MAX_CLIENTS are answered with a 503 so a burst of clients can't use up lwIP's sockets
+IDLE_TIMEOUT = 5
+MAX_CLIENTS = 6
+_active_clients = 0
+
+# /stream connections are held open indefinitely, so they are counted separately from MAX_CLIENTS. A comment
+# line is sent every STREAM_HEARTBEAT seconds without a fix, so a closed stream is noticed and its socket freed.
+MAX_STREAMS = 4
+STREAM_HEARTBEAT = 5
+STREAM_HEARTBEAT_EVENT = b": \n\n"
+_active_streams = 0
+
+# Limits on the request line and headers of a request, clients exceeding them are disconnected
+MAX_HEADER_BYTES = 2048
+HEADER_TIMEOUT = 2
+# Largest single read of a request head
+HEADER_CHUNK = 512
+
+# Final header lines of a response, ending the header block
+CLOSE_HEADERS = b"Connection: close\r\n\r\n"
+KEEP_ALIVE_HEADERS = (
+    "Connection: keep-alive\r\nKeep-Alive: timeout=%d\r\n\r\n" % IDLE_TIMEOUT
+).encode()
+
+SERVICE_UNAVAILABLE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    + CORS_HEADERS
+    + b"Retry-After: 1\r\nContent-Length: 0\r\n"
+    + CLOSE_HEADERS
+)
+
+# Headers of the GET / response, completed with the content type and body length
+FIX_RESPONSE_HEAD = (
+    "HTTP/1.1 200 OK\r\n"
+    "Content-Type: %s\r\n" + CORS_HEADERS.decode() + "Content-Length: %d\r\n"
+)
+
+# Fix body and complete GET / responses (JSON and binary), serialised once per GPSController version
+_cached_version = -1
+_cached_body = b""
+_cached_close_response = b""
+_cached_keep_alive_response = b""
+_cached_bin_close_response = b""
+_cached_bin_keep_alive_response = b""
+
+# Track fixes written between drains, bounds the socket buffer while streaming history
+TRACK_DRAIN_EVERY = 16
+
+# Output buffer reused for every /stream event ("data: <fix json>\n\n"). Sharing it between streams is
+# safe as writer.write() either sends the bytes or copies them into the stream's own buffer.
+STREAM_EVENT = bytearray(256)
+STREAM_EVENT_MV = memoryview(STREAM_EVENT)
+STREAM_EVENT[0:6] = b"data: "
+
+# Output buffer for binary and delta encoded /track responses, flushed when full
+TRACK_RECORDS = bytearray(wire_format.FIX_SIZE * TRACK_DRAIN_EVERY)
+TRACK_RECORDS_MV = memoryview(TRACK_RECORDS)
+
 
 def connect_wifi():
     """
@@ -58,88 +132,480 @@ def connect_wifi():
             # If no connection after 30 seconds, hard reset
             if attempt_count > 30:
                 print("\nWifi failed. Resetting machine...")
+                gps_controller.flush_log()
                 machine.reset()
 
     print("\nNetwork config:", wlan.ifconfig())
 
 
-async def handle_client(reader: StreamReader, writer: StreamWriter):
-    try:
-        request_line = await reader.readline()
+def fix_json(fix) -> str:
+    """JSON for a gps_controller.Fix. Positions are kept as integer microdegrees and only turned into text here"""
+    return FIX_JSON % (
+        format_microdegrees(fix.latitude),
+        format_microdegrees(fix.longitude),
+        "%d.%02d" % (fix.velocity // 100, fix.velocity % 100),
+        fix.satellites,
+        fix.timestamp,
+    )
+
+
+def refresh_fix_cache():
+    """Re-serialise the fix body and GET / response if the controller has published a new fix"""
+    global _cached_version, _cached_body
+    global _cached_close_response, _cached_keep_alive_response
+    global _cached_bin_close_response, _cached_bin_keep_alive_response
+
+    version = gps_controller.version
+    if version != _cached_version:
+        fix = gps_controller.get_data()
+        body = fix_json(fix).encode()
+        head = (FIX_RESPONSE_HEAD % ("application/json", len(body))).encode()
+        _cached_close_response = head + CLOSE_HEADERS + body
+        _cached_keep_alive_response = head + KEEP_ALIVE_HEADERS + body
+        _cached_body = body
+
+        record = wire_format.pack_fix(fix)
+        head = (
+            FIX_RESPONSE_HEAD % (wire_format.CONTENT_TYPE, wire_format.FIX_SIZE)
+        ).encode()
+        _cached_bin_close_response = head + CLOSE_HEADERS + record
+        _cached_bin_keep_alive_response = head + KEEP_ALIVE_HEADERS + record
+        _cached_version = version
+
+
+def fix_body() -> bytes:
+    refresh_fix_cache()
+    return _cached_body
+
+
+def fix_response(keep_alive: bool, binary: bool = False) -> bytes:
+    refresh_fix_cache()
+    if binary:
+        if keep_alive:
+            return _cached_bin_keep_alive_response
+        return _cached_bin_close_response
+    return _cached_keep_alive_response if keep_alive else _cached_close_response
+
+
+def write_empty_response(writer: StreamWriter, status: bytes, keep_alive: bool):
+    """Write a response without a body, status is e.g. b"404 Not Found" """
+    writer.write(b"HTTP/1.1 " + status + b"\r\n")
+    writer.write(CORS_HEADERS)
+    if not status.startswith(b"204"):
+        writer.write(b"Content-Length: 0\r\n")
+    writer.write(KEEP_ALIVE_HEADERS if keep_alive else CLOSE_HEADERS)
+
 
-        # Robustly skip headers (handle empty reads)
+def write_stream_head(writer: StreamWriter, content_type: bytes, headers: bytes = b""):
+    """Write the head of a 200 response whose body is delimited by closing the connection"""
+    writer.write(b"HTTP/1.1 200 OK\r\n")
+    writer.write(b"Content-Type: " + content_type + b"\r\n")
+    writer.write(headers)
+    writer.write(CORS_HEADERS)
+    writer.write(CLOSE_HEADERS)
+
+
+class Request:
+    """Parsed request line and headers. Handlers clear keep_alive if the response must close the connection"""
+
+    def __init__(self, method: bytes, path: bytes, query: dict, version: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.keep_alive = version == b"HTTP/1.1"
+        self.headers = {}
+
+
+def wants_binary(request: Request) -> bool:
+    """Whether the client asked for packed records (see wire_format.py) instead of JSON"""
+    if request.query.get("fmt") == "bin":
+        return True
+    return b"application/octet-stream" in request.headers.get(b"accept", b"")
+
+
+class HeaderLimitError(Exception):
+    pass
+
+
+class LineReader:
+    """
+    Reads the lines of a request head in bounded chunks, so a client that never sends a newline can't grow
+    a line past the limit the way StreamReader.readline() would. Bytes read past the head (the start of a
+    pipelined request) are kept for the next call
+    """
+
+    def __init__(self, reader: StreamReader):
+        self.reader = reader
+        self.pending = b""
+
+    async def readline(self, limit: int) -> bytes:
+        """The next line including its newline, b"" once the client closes. Raises HeaderLimitError if no
+        newline arrives within `limit` bytes"""
         while True:
-            header = await reader.readline()
-            if not header or header == b"\r\n":
-                break
+            newline = self.pending.find(b"\n")
+            if 0 <= newline < limit:
+                line = self.pending[: newline + 1]
+                self.pending = self.pending[newline + 1 :]
+                return line
+            if len(self.pending) >= limit:
+                raise HeaderLimitError()
 
-        if not request_line:
-            # Connection opened but no data sent (common scanner behavior)
-            writer.close()
-            await writer.wait_closed()
-            return
+            chunk = await self.reader.read(min(limit - len(self.pending), HEADER_CHUNK))
+            if not chunk:
+                return b""
+            self.pending += chunk
 
-        request_str = request_line.decode("utf-8")
-        print(f"Request: {request_str.strip()}")  # Debug print
 
-        # Standard CORS headers required for ALL responses
-        cors_headers = (
-            b"Access-Control-Allow-Origin: *\r\n"
-            b"Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
-            b"Access-Control-Allow-Headers: *\r\n"
-        )
+# Request handlers by method and path, registered with the decorators below
+routes = {b"GET": {}}
 
-        if "OPTIONS" in request_str:
-            # Handle Preflight
-            writer.write(b"HTTP/1.1 204 No Content\r\n")
-            writer.write(cors_headers)
-            writer.write(b"Connection: close\r\n\r\n")
 
-        elif "GET / " in request_str or "GET /HTTP" in request_str:
-            # Handle Actual Request
-            try:
-                raw_gps = gps_controller.get_data()
-                # Create the dict (ensure numeric values are valid)
-                response_data = {
-                    "latitude": raw_gps.get("latitude", 0.0),
-                    "longitude": raw_gps.get("longitude", 0.0),
-                    "velocity": raw_gps.get("velocity", 0.0),
-                    "satellites": raw_gps.get("satellites", 0),
-                    "timestamp": raw_gps.get("timestamp", 0),
-                }
-
-                response_body = ujson.dumps(response_data)
-
-                writer.write(b"HTTP/1.1 200 OK\r\n")
-                writer.write(b"Content-Type: application/json\r\n")
-                writer.write(cors_headers)
-                writer.write(f"Content-Length: {len(response_body)}\r\n".encode())
-                writer.write(b"Connection: close\r\n\r\n")
-                writer.write(response_body.encode())
-            except Exception as e:
-                print(f"JSON Generation Error: {e}")
-                writer.write(b"HTTP/1.1 500 Server Error\r\n")
-                writer.write(cors_headers)
-                writer.write(b"Connection: close\r\n\r\n")
+def get(path: str):
+    def decorator(fn):
+        routes[b"GET"][path.encode()] = fn
+        return fn
+
+    return decorator
+
 
+def parse_query(query: str) -> dict:
+    """Split a query string into a dict of parameters"""
+    params = {}
+    for pair in query.split("&"):
+        equals = pair.find("=")
+        if equals < 0:
+            params[pair] = ""
         else:
-            # Handle 404 (Must also have CORS headers or browser hides the 404)
-            writer.write(b"HTTP/1.1 404 Not Found\r\n")
-            writer.write(cors_headers)
-            writer.write(b"Connection: close\r\n\r\n")
+            params[pair[:equals]] = pair[equals + 1 :]
+    return params
+
+
+def parse_request_line(line: bytes):
+    """Returns a Request for a "METHOD target HTTP/x.y" line, None if it is malformed"""
+    method_end = line.find(b" ")
+    target_end = line.find(b" ", method_end + 1)
+    if method_end <= 0 or target_end < 0:
+        return None
+
+    path = line[method_end + 1 : target_end]
+    query = {}
+    split = path.find(b"?")
+    if split >= 0:
+        try:
+            query = parse_query(path[split + 1 :].decode())
+        except UnicodeError:
+            return None
+        path = path[:split]
+
+    return Request(line[:method_end], path, query, line[target_end + 1 :].rstrip())
+
+
+async def read_headers(reader: LineReader, request: Request, size: int):
+    """Read headers into request.headers (lowercase names). Raises HeaderLimitError past MAX_HEADER_BYTES"""
+    while True:
+        header = await reader.readline(MAX_HEADER_BYTES - size)
+        if not header or header == b"\r\n" or header == b"\n":
+            break
+
+        size += len(header)
+
+        colon = header.find(b":")
+        if colon > 0:
+            name = header[:colon].strip().lower()
+            request.headers[name] = header[colon + 1 :].strip()
+
+    connection = request.headers.get(b"connection", b"").lower()
+    if b"close" in connection:
+        request.keep_alive = False
+    elif b"keep-alive" in connection:
+        request.keep_alive = True
+
+
+async def send_track(writer: StreamWriter, since, tolerance=0):
+    """
+    Stream the recorded fixes newer than `since` as {"fixes": [...], "cursor": <timestamp>}. The client passes
+    the cursor back as ?since= on its next poll to only receive new fixes. The body is written a few fixes at
+    a time and delimited by closing the connection, so its size never has to be held in RAM. Fixes within
+    `tolerance` metres of the previous one are left out.
+    """
+    write_stream_head(writer, b"application/json")
+    writer.write(b'{"fixes": [')
+
+    cursor = since or 0
+    count = 0
+    for fix in gps_controller.track_since(since, tolerance):
+        if count:
+            writer.write(b",")
+        writer.write(fix_json(fix).encode())
+
+        cursor = fix.timestamp
+        count += 1
+        if count % TRACK_DRAIN_EVERY == 0:
+            await writer.drain()
+
+    writer.write(f'], "cursor": {cursor}}}'.encode())
+
+
+async def send_track_binary(writer: StreamWriter, since, tolerance=0):
+    """send_track() with the fixes as packed records, see wire_format.py"""
+    write_stream_head(writer, wire_format.CONTENT_TYPE.encode())
+
+    offset = 0
+    for fix in gps_controller.track_since(since, tolerance):
+        wire_format.pack_fix_into(TRACK_RECORDS, offset, fix)
+        offset += wire_format.FIX_SIZE
+        if offset == len(TRACK_RECORDS):
+            writer.write(TRACK_RECORDS_MV)
+            offset = 0
+            await writer.drain()
+
+    writer.write(TRACK_RECORDS_MV[:offset])
+
+
+async def send_track_delta(writer: StreamWriter, since, tolerance=0):
+    """send_track() with the fixes delta encoded, see wire_format.py"""
+    write_stream_head(writer, wire_format.CONTENT_TYPE.encode())
+
+    encoder = wire_format.DeltaEncoder()
+    TRACK_RECORDS[0] = wire_format.DELTA_VERSION
+    offset = 1
+    flush_at = len(TRACK_RECORDS) - wire_format.DELTA_MAX_SIZE
+    for fix in gps_controller.track_since(since, tolerance):
+        offset = encoder.encode_into(TRACK_RECORDS, offset, fix)
+        if offset > flush_at:
+            writer.write(TRACK_RECORDS_MV[:offset])
+            offset = 0
+            await writer.drain()
 
+    writer.write(TRACK_RECORDS_MV[:offset])
+
+
+async def send_history(writer: StreamWriter, start, end):
+    """
+    Stream the logged fixes from `start` to `end` (fix log times, see fix_log.py) as {"fixes": [...]}, with
+    unix times. The body is delimited by closing the connection.
+    """
+    write_stream_head(writer, b"application/json")
+    writer.write(b'{"fixes": [')
+
+    separator = b""
+    for records in gps_controller.log.records(start, end):
+        for offset in range(0, len(records), fix_log.RECORD_SIZE):
+            log_time, latitude, longitude, velocity, satellites, _ = (
+                ustruct.unpack_from(fix_log.RECORD_FORMAT, records, offset)
+            )
+            record_json = LOG_FIX_JSON % (
+                format_microdegrees(latitude),
+                format_microdegrees(longitude),
+                velocity // 100,
+                velocity % 100,
+                satellites,
+                log_time + UNIX_EPOCH_OFFSET,
+            )
+            writer.write(separator)
+            writer.write(record_json.encode())
+            separator = b","
+        await writer.drain()
+
+    writer.write(b"]}")
+
+
+async def send_history_binary(writer: StreamWriter, start, end):
+    """send_history() with the records as stored in the log, see fix_log.py"""
+    write_stream_head(writer, wire_format.CONTENT_TYPE.encode())
+
+    for records in gps_controller.log.records(start, end):
+        writer.write(records)
         await writer.drain()
+
+
+async def send_stream(writer: StreamWriter):
+    """
+    Hold the connection open as a Server-Sent Events stream and push a `data:` event with the fix JSON each
+    time the GPS controller publishes a new fix, and a heartbeat comment when there has been no fix for
+    STREAM_HEARTBEAT seconds. Returns once the client disconnects.
+    """
+    write_stream_head(writer, b"text/event-stream", b"Cache-Control: no-cache\r\n")
+
+    # Only the newest fix matters to a stream, it is sent from the shared GET / cache
+    with gps_controller.fixes(1) as fixes:
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    await uasyncio.wait_for(fixes.__anext__(), STREAM_HEARTBEAT)
+                except uasyncio.TimeoutError:
+                    # Writing to a closed connection fails, ending the stream
+                    writer.write(STREAM_HEARTBEAT_EVENT)
+                    await writer.drain()
+                    continue
+
+                body = fix_body()
+                end = 6 + len(body)
+                STREAM_EVENT_MV[6:end] = body
+                STREAM_EVENT_MV[end : end + 2] = b"\n\n"
+                writer.write(STREAM_EVENT_MV[: end + 2])
+                await writer.drain()
+        except OSError:
+            pass  # Client went away
+
+
+async def close_connection(writer: StreamWriter):
+    try:
         writer.close()
         await writer.wait_closed()
-        gc.collect()
+    except Exception:
+        pass
 
+
+@get("/")
+async def index(request: Request, writer: StreamWriter):
+    try:
+        writer.write(fix_response(request.keep_alive, wants_binary(request)))
     except Exception as e:
-        print(f"Server Error: {e}")
+        print(f"JSON Generation Error: {e}")
+        write_empty_response(writer, b"500 Server Error", request.keep_alive)
+
+
+@get("/track")
+async def track(request: Request, writer: StreamWriter):
+    try:
+        since = int(request.query["since"]) if "since" in request.query else None
+        tolerance = int(request.query.get("tolerance", 0))
+    except ValueError:
+        write_empty_response(writer, b"400 Bad Request", request.keep_alive)
+        return
+
+    # Body is delimited by closing the connection
+    request.keep_alive = False
+    if request.query.get("fmt") == "delta":
+        await send_track_delta(writer, since, tolerance)
+    elif wants_binary(request):
+        await send_track_binary(writer, since, tolerance)
+    else:
+        await send_track(writer, since, tolerance)
+
+
+@get("/history")
+async def history(request: Request, writer: StreamWriter):
+    if not gps_controller.log:
+        write_empty_response(writer, b"404 Not Found", request.keep_alive)
+        return
+
+    try:
+        start = int(request.query.get("from", UNIX_EPOCH_OFFSET)) - UNIX_EPOCH_OFFSET
+        end = (
+            int(request.query["to"]) - UNIX_EPOCH_OFFSET
+            if "to" in request.query
+            else 0xFFFFFFFF
+        )
+    except ValueError:
+        write_empty_response(writer, b"400 Bad Request", request.keep_alive)
+        return
+
+    # Body is delimited by closing the connection
+    request.keep_alive = False
+    if wants_binary(request):
+        await send_history_binary(writer, max(start, 0), end)
+    else:
+        await send_history(writer, max(start, 0), end)
+
+
+@get("/stream")
+async def stream(request: Request, writer: StreamWriter):
+    global _active_clients, _active_streams
+
+    request.keep_alive = False
+    if _active_streams >= MAX_STREAMS:
+        writer.write(SERVICE_UNAVAILABLE)
+        return
+
+    # Move the connection from the client count to the stream count while it streams
+    _active_clients -= 1
+    _active_streams += 1
+    try:
+        await send_stream(writer)
+    finally:
+        _active_streams -= 1
+        _active_clients += 1
+
+
+async def handle_client(reader: StreamReader, writer: StreamWriter):
+    global _active_clients
+
+    if _active_clients >= MAX_CLIENTS:
         try:
-            writer.close()
-            await writer.wait_closed()
+            writer.write(SERVICE_UNAVAILABLE)
+            await writer.drain()
         except Exception:
             pass
+        await close_connection(writer)
+        return
+
+    _active_clients += 1
+    lines = LineReader(reader)
+    try:
+        # Serve requests until the client closes, asks to close or goes idle. Pipelined requests are
+        # already waiting in `lines` or the reader and are answered in order.
+        while True:
+            try:
+                request_line = await uasyncio.wait_for(
+                    lines.readline(MAX_HEADER_BYTES), IDLE_TIMEOUT
+                )
+            except uasyncio.TimeoutError:
+                break
+            except HeaderLimitError:
+                write_empty_response(writer, b"414 URI Too Long", False)
+                await writer.drain()
+                break
+
+            if not request_line:
+                # Connection closed, or opened with no data sent (common scanner behavior)
+                break
+
+            request = parse_request_line(request_line)
+            if request is None:
+                write_empty_response(writer, b"400 Bad Request", False)
+                await writer.drain()
+                break
+
+            # Bound the headers in both size and time so slow or oversized headers can't hold the loop
+            try:
+                await uasyncio.wait_for(
+                    read_headers(lines, request, len(request_line)), HEADER_TIMEOUT
+                )
+            except HeaderLimitError:
+                write_empty_response(
+                    writer, b"431 Request Header Fields Too Large", False
+                )
+                await writer.drain()
+                break
+            except uasyncio.TimeoutError:
+                write_empty_response(writer, b"408 Request Timeout", False)
+                await writer.drain()
+                break
+
+            handler = routes.get(request.method, {}).get(request.path)
+            if request.method == b"OPTIONS":
+                # Handle Preflight
+                write_empty_response(writer, b"204 No Content", request.keep_alive)
+            elif handler:
+                await handler(request, writer)
+            else:
+                # Handle 404 (Must also have CORS headers or browser hides the 404)
+                write_empty_response(writer, b"404 Not Found", request.keep_alive)
+
+            await writer.drain()
+            if not request.keep_alive:
+                break
+
+    except Exception as e:
+        print(f"Server Error: {e}")
+
+    finally:
+        _active_clients -= 1
+        await close_connection(writer)
+        gc.collect()
 
 
 async def main_loop() -> None:
@@ -164,5 +630,6 @@ if __name__ == "__main__":
         raise
     except Exception as e:
         print("Critical Error:", e)
+        gps_controller.flush_log()
         time.sleep(5)
         machine.reset()
@@ -0,0 +1,76 @@
+"""
+Configuration commands for the GPS receiver, sent by GPSController.configure_receiver() at startup.
+
+MediaTek receivers (PMTK, e.g. the PA1616 in Adafruit's Ultimate GPS) take NMEA style "$PMTK..." sentences,
+u-blox receivers (e.g. the NEO-6M and NEO-M8N) binary UBX frames. Neither saves the settings: after a power
+cycle the receiver is back to its defaults (9600 baud, 1 Hz), which is why they are sent on every start.
+
+Each function returns the commands as a tuple of bytes, in the order they should be written.
+"""
+
+import ustruct
+
+# NMEA sentence types in the order of the PMTK314 fields that enable them
+PMTK_SENTENCES = ("GLL", "RMC", "VTG", "GGA", "GSA", "GSV")
+# u-blox message ids of the standard NMEA sentences (class 0xF0)
+UBX_SENTENCES = {
+    "GGA": 0x00,
+    "GLL": 0x01,
+    "GSA": 0x02,
+    "GSV": 0x03,
+    "RMC": 0x04,
+    "VTG": 0x05,
+}
+
+
+def pmtk(body: str) -> bytes:
+    """A "$<body>*<checksum>" command"""
+    checksum = 0
+    for char in body:
+        checksum ^= ord(char)
+    return ("$%s*%02X\r\n" % (body, checksum)).encode()
+
+
+def ubx(message_class: int, message_id: int, payload: bytes) -> bytes:
+    """A UBX frame: sync chars, class, id, length, payload and the 8 bit Fletcher checksum"""
+    frame = bytearray(b"\xb5\x62")
+    frame += ustruct.pack("<BBH", message_class, message_id, len(payload))
+    frame += payload
+    a = b = 0
+    for byte in frame[2:]:
+        a = (a + byte) & 0xFF
+        b = (b + a) & 0xFF
+    frame.append(a)
+    frame.append(b)
+    return bytes(frame)
+
+
+def mtk_commands(sentences, rate_hz: int, baudrate: int = 0) -> tuple:
+    """Output only `sentences` at `rate_hz` fixes per second, then switch to `baudrate` if given"""
+    fields = ",".join("1" if name in sentences else "0" for name in PMTK_SENTENCES)
+    commands = (
+        pmtk("PMTK314," + fields + ",0,0,0,0,0,0,0,0,0,0,0,0,0"),
+        pmtk("PMTK220,%d" % (1000 // rate_hz)),
+    )
+    if baudrate:
+        commands += (pmtk("PMTK251,%d" % baudrate),)
+    return commands
+
+
+def ubx_commands(sentences, rate_hz: int, baudrate: int = 0) -> tuple:
+    """u-blox equivalent of mtk_commands(), for the receiver's UART1"""
+    commands = tuple(
+        # CFG-MSG: output rate of the message on the port the command is received on
+        ubx(0x06, 0x01, bytes((0xF0, message_id, 1 if name in sentences else 0)))
+        for name, message_id in UBX_SENTENCES.items()
+    )
+    # CFG-RATE: measurement interval in ms, one navigation solution per measurement, aligned to GPS time
+    commands += (ubx(0x06, 0x08, ustruct.pack("<HHH", 1000 // rate_hz, 1, 1)),)
+    if baudrate:
+        # CFG-PRT: UART1, 8N1, UBX and NMEA in and out
+        payload = ustruct.pack("<BBHIIHHHH", 1, 0, 0, 0x08D0, baudrate, 3, 3, 0, 0)
+        commands += (ubx(0x06, 0x00, payload),)
+    return commands
+
+
+RECEIVERS = {"mtk": mtk_commands, "ubx": ubx_commands}
@@ -0,0 +1,107 @@
+"""
+Packed binary fix records, the compact alternative to the JSON responses. Served for GET / and GET /track when
+the request has ?fmt=bin or an `Accept: application/octet-stream` header.
+
+A fix is 16 bytes, little-endian (ustruct format "<iiHBBI"):
+
+    offset  type    field
+    0       int32   latitude, microdegrees (negative south)
+    4       int32   longitude, microdegrees (negative west)
+    8       uint16  velocity, hundredths of a mph
+    10      uint8   satellites in use
+    11      uint8   padding, always 0
+    12      uint32  timestamp, ticks_ms() fix time
+
+GET / returns one record, GET /track the recorded fixes as consecutive records, oldest first. The timestamp of
+the last record is the cursor for the next ?since=. test/wire_format.py decodes both on the host.
+
+GET /track?fmt=delta is smaller still for long downloads: a version byte (DELTA_VERSION) followed by one
+variable length record per fix, each five unsigned LEB128 varints:
+
+    zig-zag(latitude - previous latitude)      microdegrees, the previous fix of the first record is all 0
+    zig-zag(longitude - previous longitude)
+    zig-zag(ticks_diff(timestamp, previous timestamp))    timestamps wrap at 2**30 like ticks_ms()
+    velocity                                   hundredths of a mph
+    satellites
+
+A 1 Hz fix usually takes 6 to 8 bytes.
+"""
+
+import ustruct
+
+# The pad byte is an explicit B: MicroPython's ustruct doesn't document the "x" pad code
+FIX_FORMAT = "<iiHBBI"
+FIX_SIZE = 16
+CONTENT_TYPE = "application/octet-stream"
+
+DELTA_VERSION = 1
+# Longest delta record: 3 varints of up to 31 bits (5 bytes each), 16 bit (3 bytes) and 8 bit (2 bytes)
+DELTA_MAX_SIZE = 20
+TICKS_PERIOD = 1 << 30
+
+
+def pack_fix_into(buffer, offset, fix):
+    """Write the record for a gps_controller.Fix into `buffer` at `offset`"""
+    ustruct.pack_into(
+        FIX_FORMAT,
+        buffer,
+        offset,
+        fix.latitude,
+        fix.longitude,
+        fix.velocity,
+        fix.satellites,
+        0,
+        fix.timestamp,
+    )
+
+
+def pack_fix(fix) -> bytes:
+    """Record for a gps_controller.Fix"""
+    return ustruct.pack(
+        FIX_FORMAT,
+        fix.latitude,
+        fix.longitude,
+        fix.velocity,
+        fix.satellites,
+        0,
+        fix.timestamp,
+    )
+
+
+def _put_varint(buffer, offset, value):
+    while value > 0x7F:
+        buffer[offset] = (value & 0x7F) | 0x80
+        value >>= 7
+        offset += 1
+    buffer[offset] = value
+    return offset + 1
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+class DeltaEncoder:
+    """Encodes consecutive fixes as delta records, see the module docstring"""
+
+    def __init__(self):
+        self._latitude = 0
+        self._longitude = 0
+        self._timestamp = 0
+
+    def encode_into(self, buffer, offset, fix):
+        """Write the record for a gps_controller.Fix into `buffer` at `offset` and return the offset after it"""
+        # Wrap-safe difference of ticks, as utime.ticks_diff()
+        d_time = (fix.timestamp - self._timestamp + TICKS_PERIOD // 2) % TICKS_PERIOD
+        d_time -= TICKS_PERIOD // 2
+
+        offset = _put_varint(buffer, offset, _zigzag(fix.latitude - self._latitude))
+        offset = _put_varint(buffer, offset, _zigzag(fix.longitude - self._longitude))
+        offset = _put_varint(buffer, offset, _zigzag(d_time))
+        offset = _put_varint(buffer, offset, fix.velocity)
+        offset = _put_varint(buffer, offset, fix.satellites)
+
+        self._latitude = fix.latitude
+        self._longitude = fix.longitude
+        self._timestamp = fix.timestamp
+        return offset
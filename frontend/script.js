@@ -1,7 +1,9 @@
 const ESP32_IP = "10.0.0.54";
 const PORT = "5001";
 const API_URL = `http://${ESP32_IP}:${PORT}/`;
+const STREAM_URL = `${API_URL}stream`; // pushes each new fix, polling API_URL is the fallback
 const UPDATE_INTERVAL_MS = 1000;
+const STREAM_RETRY_MS = 30000; // while polling, how often to try the stream again
 const FALLBACK_COORDS = [42.3142, -71.042]; // fallback to umass boston coordinates if initial api call fails
 const INITIAL_ZOOM = 20;
 let centeringEnabled = true;
@@ -37,10 +39,7 @@ async function fetchData(url) {
 	}
 }
 
-async function update(marker, map) {
-	const data = await fetchData(API_URL);
-	if (!data) return;
-
+function showData(data, marker, map) {
 	const validCoords =
 		typeof data.latitude === "number" &&
 		typeof data.longitude === "number" &&
@@ -61,6 +60,41 @@ async function update(marker, map) {
 	updateElementText("timestamp", `Timestamp: ${data.timestamp}`);
 }
 
+async function update(marker, map) {
+	const data = await fetchData(API_URL);
+	if (!data) return;
+	showData(data, marker, map);
+}
+
+function startPolling(marker, map) {
+	// Update the map every `UPDATE_INTERVAL_MS` ms
+	return setInterval(() => update(marker, map), UPDATE_INTERVAL_MS);
+}
+
+function startStream(marker, map, pollingId = null) {
+	const source = new EventSource(STREAM_URL);
+	source.onopen = () => {
+		// Streaming (again), polling is no longer needed
+		if (pollingId !== null) {
+			clearInterval(pollingId);
+			pollingId = null;
+		}
+	};
+	source.onmessage = (event) => showData(JSON.parse(event.data), marker, map);
+	source.onerror = () => {
+		// A dropped stream is reconnected by the browser, which keeps the CONNECTING state meanwhile
+		if (source.readyState !== EventSource.CLOSED) return;
+
+		// The API refused the stream (e.g. a 503 when busy, or a 404 from an API without one): poll, and try
+		// the stream again later
+		source.close();
+		if (pollingId === null) {
+			pollingId = startPolling(marker, map);
+		}
+		setTimeout(() => startStream(marker, map, pollingId), STREAM_RETRY_MS);
+	};
+}
+
 async function startMap() {
 	const data = await fetchData(API_URL);
 	let initial_coords = FALLBACK_COORDS;
@@ -107,9 +141,12 @@ async function startMap() {
 	updateToggleLabel();
 	map.dragging.disable();
 
-	sleep(UPDATE_INTERVAL_MS); // Start by sleeping, we already fetched data and updated map
-	// Update the map every `UPDATE_INTERVAL_MS` ms
-	setInterval(() => update(marker, map), UPDATE_INTERVAL_MS);
+	if (window.EventSource) {
+		startStream(marker, map);
+	} else {
+		sleep(UPDATE_INTERVAL_MS); // Start by sleeping, we already fetched data and updated map
+		startPolling(marker, map);
+	}
 }
 
 startMap();
@@ -1,10 +1,23 @@
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import json
+import re
+
+
+class HTTPError(Exception):
+    """Raised by a route handler to answer with an error status instead of a 200"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
 
 
 class APIHandler(BaseHTTPRequestHandler):
     routes = {"GET": {}}
+    # Routes with <name> parameters, as (compiled pattern, handler) pairs tried in registration order
+    pattern_routes = {"GET": []}
+    # Encoders of handler results into packed records (see test/wire_format.py), by handler
+    binary_encoders = {}
 
     def _set_cors(self):
         self.send_header("Access-Control-Allow-Origin", "*")
@@ -18,6 +31,19 @@ class APIHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(data).encode())
 
+    def _send_binary(self, code: int, data: bytes):
+        self.send_response(code)
+        self._set_cors()
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _wants_binary(self, args: dict) -> bool:
+        return args.get(
+            "fmt"
+        ) == "bin" or "application/octet-stream" in self.headers.get("Accept", "")
+
     def do_OPTIONS(self):
         self.send_response(200)
         self._set_cors()
@@ -30,21 +56,52 @@ class APIHandler(BaseHTTPRequestHandler):
             k: v[0] if len(v) == 1 else v for k, v in parse_qs(parsed.query).items()
         }
         handler = self.routes["GET"].get(path)
+        params = {}
+
+        if not handler:
+            for pattern, pattern_handler in self.pattern_routes["GET"]:
+                match = pattern.fullmatch(path)
+                if match:
+                    handler, params = pattern_handler, match.groupdict()
+                    break
 
         if not handler:
             self._send_json(404, {"error": "not found"})
             return
 
+        encoder = self.binary_encoders.get(handler)
+        binary = self._wants_binary(args)
+        if binary and not encoder and args.get("fmt") == "bin":
+            self._send_json(406, {"error": "no binary format for this endpoint"})
+            return
+
         try:
-            result = handler(args)
-            self._send_json(200, result)
+            result = handler(args, **params)
+            if binary and encoder:
+                self._send_binary(200, encoder(result))
+            else:
+                self._send_json(200, result)
+        except HTTPError as e:
+            self._send_json(e.code, {"error": str(e)})
         except Exception as e:
             self._send_json(500, {"error": str(e)})
 
     @classmethod
-    def get(cls, path):
+    def get(cls, path, binary=None):
+        """
+        Registers a GET handler, called with the query arguments. Path segments written as <name> match any
+        segment and are passed to the handler as keyword arguments, e.g. "/bikes/<bike_id>". `binary` encodes
+        the handler's result as packed records for clients asking for application/octet-stream.
+        """
+
         def decorator(fn):
-            cls.routes["GET"][path] = fn
+            if binary:
+                cls.binary_encoders[fn] = binary
+            if "<" in path:
+                pattern = re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", path)
+                cls.pattern_routes["GET"].append((re.compile(pattern), fn))
+            else:
+                cls.routes["GET"][path] = fn
             return fn
 
         return decorator
@@ -0,0 +1,109 @@
+"""
+HTTP latency under NMEA parse load, with the GPS parsing on the asyncio loop and on a _thread worker
+(GPSConfig.THREADED).
+
+For each mode the firmware server runs on CPython (see test/firmware_shim.py) in a child process, parsing every
+sentence type of a multi-constellation stream, GSV included, while dashboards poll GET / with keep-alive (see
+test/load_test.py). The host parses far faster than the ESP32, so the stream is fed --epochs epochs at a time
+every --interval seconds to give parse bursts of a length comparable to the device's.
+
+    python3 -m test.bench_dual_core
+    python3 -m test.bench_dual_core --epochs 200 --clients 4 --rate 20
+
+On CPython, as on MicroPython's ESP32 port, Python threads share one interpreter lock, so the worker interleaves
+with the server rather than running on the other core: a request no longer waits for a whole burst to be parsed.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+
+from test import firmware_shim
+from test.load_test import report_header, report_step, run_step
+from test.nmea_replay import synthetic_stream
+
+PORT = 5098
+NMEA_RATE_HZ = 10
+
+
+async def feed_bursts(main, epochs, interval):
+    seconds = 600
+    data = synthetic_stream(NMEA_RATE_HZ, seconds, multi_constellation=True)
+    burst = len(data) // (seconds * NMEA_RATE_HZ) * epochs
+
+    await asyncio.start_server(main.handle_client, "127.0.0.1", PORT)
+    asyncio.create_task(main.gps_controller.run())
+    uart = main.gps_controller._uart
+    while True:
+        for start in range(0, len(data), burst):
+            uart.feed(data[start : start + burst])
+            await asyncio.sleep(interval)
+
+
+def serve(threaded, epochs, interval):
+    firmware_shim.install()
+    from gps_controller import GPSConfig
+
+    GPSConfig.THREADED = threaded
+    # Parse everything, the load a GSV burst puts on the device
+    GPSConfig.SENTENCES = None
+    GPSConfig.LOG = False
+    main = firmware_shim.import_main(PORT)
+    asyncio.run(feed_bursts(main, epochs, interval))
+
+
+def start_server(threaded, epochs, interval):
+    server = multiprocessing.Process(
+        target=serve, args=(threaded, epochs, interval), daemon=True
+    )
+    server.start()
+
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", PORT), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Shim server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare HTTP latency with parsing on the asyncio loop and on a thread"
+    )
+    parser.add_argument(
+        "--epochs", type=int, default=100, help="NMEA epochs fed per burst"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.1, help="seconds between bursts"
+    )
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument(
+        "--rate", type=float, default=10.0, help="requests/s per client"
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per mode")
+    parser.add_argument("--timeout", type=float, default=5.0, help="request timeout")
+    args = parser.parse_args()
+
+    # Settings run_step() reads
+    args.host, args.port = "127.0.0.1", PORT
+    args.paths = ["/"]
+    args.keep_alive = True
+    args.streams = 0
+
+    for threaded in (False, True):
+        print(f"\n{'_thread worker' if threaded else 'asyncio loop'}:")
+        server = start_server(threaded, args.epochs, args.interval)
+        try:
+            report_header()
+            stats = asyncio.run(run_step(args, args.clients))
+            report_step(args.clients, stats, args.duration)
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == "__main__":
+    main()
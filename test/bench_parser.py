@@ -0,0 +1,123 @@
+"""
+Heap usage of MicropyGPS sentence segmentation, per-character update() (before) against buffered update_bytes()
+(after).
+
+Under MicroPython the numbers are exact bytes allocated: the GC is disabled around each batch and gc.mem_alloc()
+is read before and after. Run from the repository root, on the ESP32 with the firmware directory mounted so
+`libraries` is importable, or on MicroPython's unix port:
+
+    mpremote mount firmware/esp32 run test/bench_parser.py
+    MICROPYPATH=firmware/esp32 micropython test/bench_parser.py
+
+On CPython, tracemalloc is used instead and the figure is the peak live heap growth while a batch is parsed. Memory
+freed again before the peak isn't counted, so it is lower than the bytes allocated:
+
+    python3 -m test.bench_parser
+"""
+
+import gc
+import sys
+
+try:
+    from libraries.micropyGPS import MicropyGPS
+except ImportError:
+    from pathlib import Path
+
+    sys.path.insert(
+        0, str(Path(__file__).resolve().parent.parent / "firmware" / "esp32")
+    )
+    from libraries.micropyGPS import MicropyGPS
+
+try:
+    from time import ticks_diff, ticks_us  # type: ignore
+except ImportError:
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# One 1 Hz epoch from a typical receiver
+EPOCH = (
+    b"$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A\r\n"
+    b"$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n"
+    b"$GPGSA,A,3,04,05,,09,12,,,24,,,,,2.5,1.3,2.1*39\r\n"
+    b"$GPGSV,2,1,08,01,40,083,46,02,17,308,41,12,07,344,39,14,22,228,45*75\r\n"
+    b"$GPGSV,2,2,08,15,20,200,40,17,35,120,44,19,60,045,48,22,12,330,36*77\r\n"
+    b"$GPVTG,054.7,T,034.4,M,005.5,N,010.2,K*48\r\n"
+)
+EPOCH_SENTENCES = EPOCH.count(b"$")
+
+# Epochs parsed between heap readings, small enough that the ESP32 heap never fills with the GC disabled
+BATCH_EPOCHS = 2
+BATCHES = 10
+
+
+def feed_chars(gps, data):
+    """The original GPSController loop, one update() call per received byte"""
+    for byte in data:
+        gps.update(chr(byte))
+
+
+def feed_bytes(gps, data):
+    gps.update_bytes(data)
+
+
+def measure(feed):
+    gps = MicropyGPS(location_formatting="dd")
+    data = EPOCH * BATCH_EPOCHS
+    feed(gps, data)  # Warm up so lazily created state isn't counted
+
+    heap = 0
+    for _ in range(BATCHES):
+        gc.collect()
+        if tracemalloc:
+            tracemalloc.start()
+            feed(gps, data)
+            heap += tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            gc.disable()
+            before = gc.mem_alloc()  # type: ignore
+            feed(gps, data)
+            heap += gc.mem_alloc() - before  # type: ignore
+            gc.enable()
+
+    # Timed separately, tracing slows the host down considerably
+    gc.collect()
+    start = ticks_us()
+    for _ in range(BATCHES):
+        feed(gps, data)
+    elapsed = ticks_diff(ticks_us(), start)
+
+    sentences = EPOCH_SENTENCES * BATCH_EPOCHS * BATCHES
+    return heap / sentences, elapsed / sentences
+
+
+def main():
+    print(
+        "Heap per sentence: %s"
+        % (
+            "peak live heap bytes, not allocations"
+            if tracemalloc
+            else "bytes allocated"
+        )
+    )
+    for label, feed in (
+        ("update() per char", feed_chars),
+        ("update_bytes()", feed_bytes),
+    ):
+        heap, elapsed = measure(feed)
+        print("%-18s %8.1f B/sentence %8.1f us/sentence" % (label, heap, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Parser throughput on the host: replays synthetic or recorded NMEA streams through MicropyGPS and GPSController.
+
+Each stream is fed through
+  - update()            one call per received byte, the original GPSController loop
+  - update_bytes()      bulk parsing of each UART read, every sentence type parsed
+  - filtered            update_bytes() with the controller's sentence filter
+  - GPSController       the controller's run() loop reading a shim UART (see test/firmware_shim.py)
+
+and the report lists sentences per second, microseconds per received byte and the peak live heap per sentence:
+the most the traced heap grew while a chunk was parsed, summed over the chunks. Memory that is allocated and
+freed again before the peak isn't counted, so this is not bytes allocated, which is what the ESP32's GC pays
+for. test/bench_parser.py measures that under MicroPython.
+
+    python3 -m test.bench_replay
+    python3 -m test.bench_replay --rates 10 --seconds 300 --crc-errors 0.05
+    python3 -m test.bench_replay --file ride.nmea
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import time
+import tracemalloc
+
+from test import firmware_shim
+from test.nmea_replay import chunks, count_sentences, load_stream, synthetic_stream
+
+firmware_shim.install()
+
+from gps_controller import GPSConfig, GPSController  # noqa: E402
+from libraries.micropyGPS import MicropyGPS  # noqa: E402
+
+# Parse every read straight away, the replay queues whole streams so batching would only add the read deadline
+GPSConfig.MIN_CHUNK = 1
+
+
+def feed_chars(data, measure_chunk):
+    gps = MicropyGPS(location_formatting="dd")
+    for chunk in chunks(data, GPSConfig.RX_BUF):
+        with measure_chunk:
+            for byte in chunk:
+                gps.update(chr(byte))
+    return gps.clean_sentences
+
+
+def feed_bytes(data, measure_chunk):
+    gps = MicropyGPS(location_formatting="dd")
+    for chunk in chunks(data, GPSConfig.RX_BUF):
+        with measure_chunk:
+            gps.update_bytes(chunk)
+    return gps.clean_sentences
+
+
+def feed_filtered(data, measure_chunk):
+    gps = MicropyGPS(location_formatting="udeg", sentence_filter=GPSConfig.SENTENCES)
+    for chunk in chunks(data, GPSConfig.RX_BUF):
+        with measure_chunk:
+            gps.update_bytes(chunk)
+    return gps.clean_sentences
+
+
+def feed_controller(data, measure_chunk):
+    async def replay():
+        controller = GPSController()
+        uart = controller._uart
+        task = asyncio.create_task(controller.run())
+        await asyncio.sleep(0)  # Let run() start polling
+
+        # The controller parses everything available before it yields, so the UART being empty means the
+        # queued bytes are parsed
+        if measure_chunk.tracing:
+            for chunk in chunks(data, GPSConfig.RX_BUF):
+                with measure_chunk:
+                    uart.feed(chunk)
+                    while uart.any():
+                        await asyncio.sleep(0)
+        else:
+            uart.feed(data)
+            while uart.any():
+                await asyncio.sleep(0)
+
+        task.cancel()
+        return controller._gps.clean_sentences
+
+    with contextlib.redirect_stdout(io.StringIO()):  # run() announces itself
+        return asyncio.run(replay())
+
+
+PATHS = (
+    ("update()", feed_chars),
+    ("update_bytes()", feed_bytes),
+    ("filtered", feed_filtered),
+    ("GPSController", feed_controller),
+)
+
+
+class ChunkHeap:
+    """Context manager summing the peak live heap growth while each chunk is parsed, a no-op unless tracing"""
+
+    def __init__(self, tracing):
+        self.tracing = tracing
+        self.total = 0
+
+    def __enter__(self):
+        if self.tracing:
+            tracemalloc.reset_peak()
+            self._start = tracemalloc.get_traced_memory()[0]
+
+    def __exit__(self, *exc_info):
+        if self.tracing:
+            self.total += tracemalloc.get_traced_memory()[1] - self._start
+
+
+def measure(feed, data, heap=True):
+    """(sentences parsed, seconds, heap bytes) for one replay of `data`"""
+    gc.collect()
+    start = time.perf_counter()
+    parsed = feed(data, ChunkHeap(False))
+    elapsed = time.perf_counter() - start
+
+    # Traced separately, tracing slows the host down considerably
+    heap_bytes = 0
+    if heap:
+        chunk_heap = ChunkHeap(True)
+        gc.collect()
+        tracemalloc.start()
+        feed(data, chunk_heap)
+        tracemalloc.stop()
+        heap_bytes = chunk_heap.total
+
+    return parsed, elapsed, heap_bytes
+
+
+def report(label, data, heap=True):
+    sentences = count_sentences(data)
+    print(f"\n{label}: {len(data)} bytes, {sentences} sentences")
+    print(
+        f"  {'path':<16}{'parsed':>8}{'sentences/s':>14}{'us/byte':>10}{'peak heap B/sentence':>22}"
+    )
+    for name, feed in PATHS:
+        parsed, elapsed, heap_bytes = measure(feed, data, heap)
+        heap_text = f"{heap_bytes / sentences:22.1f}" if heap else f"{'-':>22}"
+        print(
+            f"  {name:<16}{parsed:>8}{sentences / elapsed:>14.0f}{elapsed * 1e6 / len(data):>10.3f}{heap_text}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay NMEA streams through the GPS parser and controller"
+    )
+    parser.add_argument(
+        "--file", help="replay a recorded stream instead of the synthetic scenarios"
+    )
+    parser.add_argument(
+        "--rates",
+        type=int,
+        nargs="+",
+        default=[1, 5, 10],
+        help="navigation rates in Hz",
+    )
+    parser.add_argument(
+        "--seconds", type=int, default=60, help="length of each synthetic stream"
+    )
+    parser.add_argument(
+        "--crc-errors", type=float, default=0.02, help="fraction of corrupted sentences"
+    )
+    parser.add_argument(
+        "--no-heap", action="store_true", help="skip the (slow) traced heap pass"
+    )
+    args = parser.parse_args()
+    heap = not args.no_heap
+
+    if args.file:
+        report(args.file, load_stream(args.file), heap)
+        return
+
+    for rate in args.rates:
+        report(f"{rate} Hz GP", synthetic_stream(rate, args.seconds), heap)
+        report(f"{rate} Hz GN/GL", synthetic_stream(rate, args.seconds, True), heap)
+        report(
+            f"{rate} Hz GN/GL, {args.crc_errors:.0%} CRC errors",
+            synthetic_stream(rate, args.seconds, True, args.crc_errors),
+            heap,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Checks that MicropyGPS.update_bytes() parses exactly what the per-character update() does: the same sentences,
+in the same order, leaving the same parsed state behind. update_bytes() is the parser on the tracker, update()
+the original implementation it replaced, so any parser change should keep this passing.
+
+Noisy synthetic streams (CRC errors and non-ASCII bytes, see test/nmea_replay.py) are fed in reads of random
+sizes, so sentences are cut at every possible point, with and without the controller's sentence filter.
+
+    python3 -m test.check_parser
+    python3 -m test.check_parser --rates 1 5 10 --seconds 120 --crc-errors 0.1 --seed 3
+"""
+
+import argparse
+import random
+
+from test import firmware_shim
+from test.nmea_replay import synthetic_stream
+
+firmware_shim.install()
+
+from gps_controller import GPSConfig  # noqa: E402
+from libraries.micropyGPS import MicropyGPS  # noqa: E402
+
+# Parsed state compared after every read. char_count and crc_fails are left out: update() counts and checksums
+# the printable characters of a sentence with a non-ASCII byte in it, update_bytes() drops it on decoding
+STATE = (
+    "timestamp",
+    "date",
+    "latitude",
+    "longitude",
+    "speed",
+    "course",
+    "altitude",
+    "geoid_height",
+    "satellites_in_view",
+    "satellites_in_use",
+    "satellites_used",
+    "satellite_data",
+    "last_sv_sentence",
+    "total_sv_sentences",
+    "hdop",
+    "vdop",
+    "pdop",
+    "fix_stat",
+    "fix_type",
+    "valid",
+    "clean_sentences",
+    "parsed_sentences",
+)
+
+
+def state(gps: MicropyGPS) -> dict:
+    return {name: getattr(gps, name) for name in STATE}
+
+
+def reads(data: bytes, rng: random.Random, max_size: int):
+    """`data` split into reads of 1 to max_size bytes"""
+    start = 0
+    while start < len(data):
+        end = start + rng.randint(1, max_size)
+        yield data[start:end]
+        start = end
+
+
+def check(label: str, data: bytes, seed: int, **options) -> int:
+    """Feeds `data` through both paths and asserts they agree after every read. Returns the sentences parsed"""
+    by_char = MicropyGPS(**options)
+    by_bytes = MicropyGPS(**options)
+
+    for index, chunk in enumerate(reads(data, random.Random(seed), GPSConfig.RX_BUF)):
+        char_types = []
+        for byte in chunk:
+            sentence_type = by_char.update(chr(byte))
+            if sentence_type:
+                char_types.append(sentence_type)
+        bytes_types = by_bytes.update_bytes(chunk)
+
+        assert (
+            bytes_types == char_types
+        ), f"{label}: read {index} parsed {bytes_types}, update() parsed {char_types}"
+        expected = state(by_char)
+        for name, value in state(by_bytes).items():
+            assert (
+                value == expected[name]
+            ), f"{label}: read {index} left {name} = {value!r}, update() {expected[name]!r}"
+
+    return by_bytes.clean_sentences
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that update_bytes() and update() parse the same"
+    )
+    parser.add_argument(
+        "--rates", type=int, nargs="+", default=[1, 5], help="navigation rates in Hz"
+    )
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument(
+        "--crc-errors", type=float, default=0.05, help="fraction of corrupted sentences"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for rate in args.rates:
+        for multi in (False, True):
+            data = synthetic_stream(
+                rate, args.seconds, multi, args.crc_errors, args.seed
+            )
+            for sentence_filter in (None, GPSConfig.SENTENCES):
+                label = f"{rate} Hz {'GN/GL' if multi else 'GP'}" + (
+                    ", filtered" if sentence_filter else ""
+                )
+                parsed = check(
+                    label,
+                    data,
+                    args.seed,
+                    location_formatting="udeg",
+                    sentence_filter=sentence_filter,
+                )
+                print(f"{label}: {parsed} sentences, identical")
+
+
+if __name__ == "__main__":
+    main()
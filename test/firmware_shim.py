@@ -0,0 +1,219 @@
+"""
+CPython stand-ins for the MicroPython modules the firmware imports (machine, network, uasyncio, utime, ujson,
+ustruct; CPython's own _thread is used as is), so modules in firmware/esp32 can be imported and driven on the
+host by the benchmarks and load tests.
+
+    from test import firmware_shim
+
+    firmware_shim.install()
+    from gps_controller import GPSController
+
+    main = firmware_shim.import_main(api_port=5099)  # firmware/esp32/main.py, without connecting to WiFi
+
+The UART does not touch a serial port, bytes queued with UART.feed() are what the firmware reads.
+"""
+
+import asyncio
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+FIRMWARE_DIR = Path(__file__).resolve().parent.parent / "firmware" / "esp32"
+
+TICKS_PERIOD = 1 << 30  # MicroPython ticks wrap at the small int range
+
+
+class UART:
+    """machine.UART replaying bytes queued with feed(), written bytes are kept in `written`"""
+
+    def __init__(self, port, baudrate=9600, tx=None, rx=None, rxbuf=256, **kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.rxbuf = rxbuf
+        self.written = bytearray()
+        self._rx = bytearray()
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate:
+            self.baudrate = baudrate
+
+    def feed(self, data):
+        self._rx += data
+
+    def any(self):
+        return len(self._rx)
+
+    def read(self, nbytes=-1):
+        if not self._rx:
+            return None
+        if nbytes < 0:
+            nbytes = len(self._rx)
+        data = bytes(self._rx[:nbytes])
+        del self._rx[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(len(buf) if nbytes is None else nbytes)
+        if not data:
+            return None
+        buf[: len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+
+class StreamReader:
+    """uasyncio.StreamReader over a UART, polled the way the MicroPython scheduler polls the UART"""
+
+    POLL_INTERVAL = 0.001
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def read(self, nbytes=-1):
+        while not self._stream.any():
+            await asyncio.sleep(self.POLL_INTERVAL)
+        return self._stream.read(nbytes)
+
+    async def readinto(self, buf):
+        while not self._stream.any():
+            await asyncio.sleep(self.POLL_INTERVAL)
+        return self._stream.readinto(buf)
+
+
+class ThreadSafeFlag:
+    """uasyncio.ThreadSafeFlag: set() from any thread wakes the task waiting in wait(), which clears the flag"""
+
+    def __init__(self):
+        self._flag = False
+        self._event = None
+        self._loop = None
+
+    def set(self):
+        self._flag = True
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self):
+        if self._event is None:
+            self._event = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+        while not self._flag:
+            self._event.clear()
+            if self._flag:
+                break
+            await self._event.wait()
+        self._flag = False
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+def ticks_ms():
+    return int(time.monotonic() * 1000) % TICKS_PERIOD
+
+
+def ticks_us():
+    return int(time.monotonic() * 1000000) % TICKS_PERIOD
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
+
+
+def ticks_diff(end, start):
+    return (end - start + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
+
+
+class WLAN:
+    """Always connected, the host's own network is used"""
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def active(self, state=None):
+        return True
+
+    def connect(self, ssid, password):
+        pass
+
+    def isconnected(self):
+        return True
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def install():
+    """Registers the stand-ins in sys.modules and puts the firmware directory on sys.path"""
+    if "machine" in sys.modules:
+        return
+
+    uasyncio = _module(
+        "uasyncio", **{k: v for k, v in vars(asyncio).items() if not k.startswith("_")}
+    )
+    uasyncio.StreamReader = StreamReader
+    uasyncio.ThreadSafeFlag = ThreadSafeFlag
+    uasyncio.StreamWriter = asyncio.StreamWriter
+    uasyncio.sleep_ms = sleep_ms
+
+    utime = _module(
+        "utime", **{k: v for k, v in vars(time).items() if not k.startswith("_")}
+    )
+    utime.ticks_ms = ticks_ms
+    utime.ticks_us = ticks_us
+    utime.ticks_add = ticks_add
+    utime.ticks_diff = ticks_diff
+    utime.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    utime.sleep_us = lambda us: time.sleep(us / 1000000)
+
+    sys.modules["machine"] = _module("machine", UART=UART, reset=reset)
+    sys.modules["network"] = _module("network", WLAN=WLAN, STA_IF=0, AP_IF=1)
+    sys.modules["uasyncio"] = uasyncio
+    sys.modules["utime"] = utime
+    sys.modules["ujson"] = json
+    sys.modules["ustruct"] = struct
+
+    if str(FIRMWARE_DIR) not in sys.path:
+        sys.path.insert(0, str(FIRMWARE_DIR))
+
+    # Keep the fix log off the host's root directory
+    import fix_log
+
+    fix_log.LogConfig.DIRECTORY = tempfile.mkdtemp(prefix="fix_log_")
+
+
+def import_main(api_port=5001):
+    """Imports firmware/esp32/main.py, writing the .env file it reads from the working directory"""
+    install()
+    if "main" in sys.modules:
+        return sys.modules["main"]
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as env_dir:
+        with open(os.path.join(env_dir, ".env"), "w") as env_file:
+            env_file.write(f"WIFI_SSID=host\nWIFI_PASSWORD=host\nAPI_PORT={api_port}\n")
+        os.chdir(env_dir)
+        try:
+            import main
+        finally:
+            os.chdir(cwd)
+    return main
@@ -0,0 +1,125 @@
+"""
+Simulated fleet of bikes for load testing the dashboard and map layers at scale.
+
+Every bike rides its own generated loop route around Boston. The fleet state is kept as NumPy columns (one entry
+per bike) and each tick advances all bikes at once: velocity drifts around the bike's cruising speed, position
+moves along the route and the battery drains with distance and time. Bikes with an empty battery stop.
+"""
+
+import numpy as np
+
+CENTER = (42.3142, -71.0420)  # UMass Boston
+AREA_RADIUS_M = 8000  # Route centers are spread over this radius
+ROUTE_POINTS = 24
+ROUTE_RADIUS_M = (300, 2500)
+CRUISE_MPH = (8.0, 16.0)
+VELOCITY_REVERSION = 0.2  # Per second, pull of the velocity towards the cruising speed
+VELOCITY_NOISE = 0.8  # mph per sqrt(second)
+DRAIN_PER_MILE = (1.0, 2.5)  # Battery %
+DRAIN_PER_HOUR = 0.5  # Battery %, electronics while riding or parked
+
+METERS_PER_DEG_LAT = 111320.0
+MPH_TO_MS = 0.44704
+
+
+class Fleet:
+    def __init__(self, size: int, seed: int = 0):
+        self.size = size
+        self._rng = np.random.default_rng(seed)
+        rng = self._rng
+
+        # Routes: closed loops of waypoints in metres east/north of CENTER, one row per bike
+        centers = rng.normal(0, AREA_RADIUS_M / 2, (size, 2))
+        radius = rng.uniform(*ROUTE_RADIUS_M, (size, 1))
+        angles = np.linspace(0, 2 * np.pi, ROUTE_POINTS, endpoint=False)
+        wobble = rng.uniform(0.6, 1.4, (size, ROUTE_POINTS))
+        east = centers[:, :1] + radius * wobble * np.cos(angles)
+        north = centers[:, 1:] + radius * wobble * np.sin(angles)
+        self._route_east = np.concatenate([east, east[:, :1]], axis=1)
+        self._route_north = np.concatenate([north, north[:, :1]], axis=1)
+
+        segments = np.hypot(
+            np.diff(self._route_east, axis=1), np.diff(self._route_north, axis=1)
+        )
+        self._route_distance = np.concatenate(
+            [np.zeros((size, 1)), np.cumsum(segments, axis=1)], axis=1
+        )
+        self._route_length = self._route_distance[:, -1]
+
+        # Per-bike state columns
+        self.ids = np.arange(size)
+        self.progress = rng.uniform(0, 1, size) * self._route_length  # Metres
+        self.cruise = rng.uniform(*CRUISE_MPH, size)
+        self.velocity = self.cruise.copy()  # mph
+        self.drain_per_mile = rng.uniform(*DRAIN_PER_MILE, size)
+        self.battery = rng.uniform(40.0, 100.0, size)  # %
+        self._locate()
+
+    def _locate(self):
+        """Latitude and longitude of every bike from its progress along its route"""
+        rows = self.ids
+        segment = (self._route_distance[:, 1:-1] <= self.progress[:, None]).sum(axis=1)
+        start = self._route_distance[rows, segment]
+        fraction = (self.progress - start) / (
+            self._route_distance[rows, segment + 1] - start
+        )
+
+        east = self._route_east[rows, segment] + fraction * (
+            self._route_east[rows, segment + 1] - self._route_east[rows, segment]
+        )
+        north = self._route_north[rows, segment] + fraction * (
+            self._route_north[rows, segment + 1] - self._route_north[rows, segment]
+        )
+
+        self.latitude = CENTER[0] + north / METERS_PER_DEG_LAT
+        self.longitude = CENTER[1] + east / (
+            METERS_PER_DEG_LAT * np.cos(np.radians(self.latitude))
+        )
+
+    def tick(self, dt: float = 1.0):
+        """Advances every bike by `dt` seconds"""
+        noise = self._rng.standard_normal(self.size)
+        self.velocity += (
+            VELOCITY_REVERSION * (self.cruise - self.velocity) * dt
+            + VELOCITY_NOISE * np.sqrt(dt) * noise
+        )
+        np.clip(self.velocity, 0.0, None, out=self.velocity)
+        self.velocity[self.battery <= 0] = 0.0
+
+        distance_m = self.velocity * MPH_TO_MS * dt
+        self.progress = (self.progress + distance_m) % self._route_length
+
+        self.battery -= (
+            distance_m / 1609.344 * self.drain_per_mile + DRAIN_PER_HOUR * dt / 3600
+        )
+        np.clip(self.battery, 0.0, 100.0, out=self.battery)
+
+        self._locate()
+
+    def bike(self, bike_id: int) -> dict:
+        return {
+            "id": bike_id,
+            "latitude": round(float(self.latitude[bike_id]), 6),
+            "longitude": round(float(self.longitude[bike_id]), 6),
+            "velocity": round(float(self.velocity[bike_id]), 1),
+            "battery": round(float(self.battery[bike_id]), 1),
+        }
+
+    def bikes(self) -> list[dict]:
+        columns = zip(
+            self.ids.tolist(),
+            np.round(self.latitude, 6).tolist(),
+            np.round(self.longitude, 6).tolist(),
+            np.round(self.velocity, 1).tolist(),
+            np.round(self.battery, 1).tolist(),
+        )
+        return [
+            {
+                "id": bike_id,
+                "latitude": latitude,
+                "longitude": longitude,
+                "velocity": velocity,
+                "battery": battery,
+            }
+            for bike_id, latitude, longitude, velocity, battery in columns
+        ]
@@ -0,0 +1,286 @@
+"""
+Load test for the tracker API: many concurrent dashboards polling the server, stepped up until latency falls
+apart.
+
+Each simulated dashboard polls the given paths at --rate requests per second (keeping its connection open with
+--keep-alive) and optionally holds a /stream connection open. Every step reports latency percentiles, errors,
+refused connections and timeouts.
+
+Against the host BikeServer (python3 -m test.run_api) or an ESP32:
+
+    python3 -m test.load_test --host 10.0.0.54 --port 5001 --clients 1 2 4 8 16
+
+Against the firmware's main.handle_client running on CPython (see test/firmware_shim.py), fed a synthetic NMEA
+stream, in a child process so the clients don't share its event loop:
+
+    python3 -m test.load_test --shim --paths / /track --clients 1 4 8 --keep-alive
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import random
+import socket
+import time
+from collections import Counter
+
+from test import firmware_shim
+from test.nmea_replay import synthetic_stream
+
+SHIM_PORT = 5099
+
+
+class StepStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.refused = 0
+        self.timeouts = 0
+        self.errors = 0  # Resets, malformed responses and other socket errors
+        self.events = 0  # /stream events received
+
+    @property
+    def requests(self):
+        return len(self.latencies) + self.refused + self.timeouts + self.errors
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+async def read_response(reader):
+    """Status code of a response, its body is read by Content-Length or until the server closes"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("connection closed before a response")
+    status = int(status_line.split()[1])
+
+    length = None
+    close = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"connection" and value.strip().lower() == b"close":
+            close = True
+
+    if length is None:
+        await reader.read()
+        close = True
+    elif length:
+        await reader.readexactly(length)
+    return status, close
+
+
+class Dashboard:
+    """One simulated dashboard, polling `paths` in turn at `rate` requests per second"""
+
+    def __init__(self, host, port, paths, rate, keep_alive, timeout, stats):
+        self.host = host
+        self.port = port
+        self.paths = paths
+        self.interval = 1 / rate
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.stats = stats
+        self._connection = None
+
+    async def _request(self, path):
+        if self._connection is None:
+            self._connection = await asyncio.open_connection(self.host, self.port)
+        reader, writer = self._connection
+
+        connection = b"keep-alive" if self.keep_alive else b"close"
+        writer.write(
+            b"GET %s HTTP/1.1\r\nHost: %s\r\nConnection: %s\r\n\r\n"
+            % (path.encode(), self.host.encode(), connection)
+        )
+        await writer.drain()
+        status, close = await read_response(reader)
+
+        if close or not self.keep_alive:
+            self._close()
+        return status
+
+    def _close(self):
+        if self._connection:
+            self._connection[1].close()
+            self._connection = None
+
+    async def run(self, deadline):
+        loop = asyncio.get_running_loop()
+        # Stagger the dashboards over the first interval
+        next_request = loop.time() + random.random() * self.interval
+        request_count = 0
+
+        while next_request < deadline:
+            await asyncio.sleep(max(0, next_request - loop.time()))
+            path = self.paths[request_count % len(self.paths)]
+            request_count += 1
+            start = loop.time()
+
+            try:
+                status = await asyncio.wait_for(self._request(path), self.timeout)
+                self.stats.latencies.append(loop.time() - start)
+                self.stats.statuses[status] += 1
+            except ConnectionRefusedError:
+                self.stats.refused += 1
+                self._close()
+            except asyncio.TimeoutError:
+                self.stats.timeouts += 1
+                self._close()
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                self.stats.errors += 1
+                self._close()
+
+            # Fixed schedule, a slow response doesn't lower the offered load
+            next_request = max(next_request + self.interval, start)
+
+        self._close()
+
+    async def stream(self, deadline):
+        """Hold a /stream connection open until the deadline, counting the events received"""
+        loop = asyncio.get_running_loop()
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except ConnectionRefusedError:
+            self.stats.refused += 1
+            return
+        writer.write(b"GET /stream HTTP/1.1\r\nHost: %s\r\n\r\n" % self.host.encode())
+
+        try:
+            while loop.time() < deadline:
+                line = await asyncio.wait_for(reader.readline(), deadline - loop.time())
+                if not line:
+                    break
+                if line.startswith(b"data:"):
+                    self.stats.events += 1
+        except (asyncio.TimeoutError, OSError):
+            pass
+        writer.close()
+
+
+async def run_step(args, clients):
+    stats = StepStats()
+    deadline = asyncio.get_running_loop().time() + args.duration
+    dashboards = [
+        Dashboard(
+            args.host,
+            args.port,
+            args.paths,
+            args.rate,
+            args.keep_alive,
+            args.timeout,
+            stats,
+        )
+        for _ in range(clients)
+    ]
+
+    tasks = [dashboard.run(deadline) for dashboard in dashboards]
+    tasks += [dashboard.stream(deadline) for dashboard in dashboards[: args.streams]]
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def report_header():
+    print(
+        f"{'clients':>7}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        f"{'errors':>8}{'refused':>8}{'timeout':>8}{'events':>8}  statuses"
+    )
+
+
+def report_step(clients, stats, duration):
+    non_ok = sum(count for status, count in stats.statuses.items() if status >= 400)
+    errors = non_ok + stats.errors + stats.refused + stats.timeouts
+    error_rate = errors / stats.requests if stats.requests else 0
+    print(
+        f"{clients:>7}{stats.requests:>9}{len(stats.latencies) / duration:>8.1f}"
+        f"{stats.percentile(0.5) * 1000:>9.1f}{stats.percentile(0.9) * 1000:>9.1f}"
+        f"{stats.percentile(0.99) * 1000:>9.1f}{max(stats.latencies, default=float('nan')) * 1000:>9.1f}"
+        f"{error_rate:>8.1%}{stats.refused:>8}{stats.timeouts:>8}{stats.events:>8}  "
+        + " ".join(
+            f"{status}:{count}" for status, count in sorted(stats.statuses.items())
+        )
+    )
+
+
+async def serve_shim(port, rate_hz):
+    """Runs main.handle_client on CPython, feeding the GPS controller a synthetic ride in real time"""
+    main = firmware_shim.import_main(port)
+    await asyncio.start_server(main.handle_client, "127.0.0.1", port)
+    asyncio.create_task(main.gps_controller.run())
+
+    seconds = 600
+    data = synthetic_stream(rate_hz, seconds, multi_constellation=True)
+    epoch_bytes = len(data) // (seconds * rate_hz)
+    uart = main.gps_controller._uart
+    while True:
+        for start in range(0, len(data), epoch_bytes):
+            uart.feed(data[start : start + epoch_bytes])
+            await asyncio.sleep(1 / rate_hz)
+
+
+def run_shim(port, rate_hz):
+    asyncio.run(serve_shim(port, rate_hz))
+
+
+def start_shim(port, rate_hz):
+    server = multiprocessing.Process(target=run_shim, args=(port, rate_hz), daemon=True)
+    server.start()
+
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Shim server did not start")
+
+
+async def run(args):
+    report_header()
+    for clients in args.clients:
+        stats = await run_step(args, clients)
+        report_step(clients, stats, args.duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the tracker API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument(
+        "--shim", action="store_true", help="start the firmware server on CPython"
+    )
+    parser.add_argument("--nmea-rate", type=int, default=1, help="shim GPS rate in Hz")
+    parser.add_argument(
+        "--clients", type=int, nargs="+", default=[1, 2, 4, 8], help="steps"
+    )
+    parser.add_argument("--paths", nargs="+", default=["/"], help="paths polled")
+    parser.add_argument("--rate", type=float, default=1.0, help="requests/s per client")
+    parser.add_argument(
+        "--streams", type=int, default=0, help="clients also holding /stream open"
+    )
+    parser.add_argument("--keep-alive", action="store_true")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+    parser.add_argument("--timeout", type=float, default=5.0, help="request timeout")
+    args = parser.parse_args()
+
+    if args.shim:
+        args.host, args.port = "127.0.0.1", SHIM_PORT
+        server = start_shim(SHIM_PORT, args.nmea_rate)
+
+    try:
+        asyncio.run(run(args))
+    finally:
+        if args.shim:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
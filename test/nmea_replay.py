@@ -0,0 +1,156 @@
+"""
+Synthetic and recorded NMEA streams for replaying through MicropyGPS and GPSController on the host.
+
+Synthetic streams follow a rider heading north-east from UMass Boston at ~20 km/h. Every navigation epoch emits
+RMC, GGA and VTG; GSA and GSV (one set per constellation) are emitted once a second, as most receivers do at
+higher navigation rates. Multi-constellation streams use the GN talker for navigation sentences and GP/GL for
+the per-constellation ones.
+
+    python3 -m test.nmea_replay --rate 10 --seconds 60 --multi --crc-errors 0.02 -o ride.nmea
+"""
+
+import argparse
+import random
+import sys
+from typing import Iterator
+
+START_LATITUDE = 42.3142
+START_LONGITUDE = -71.0420
+SPEED_KNOTS = 10.8  # ~20 km/h
+COURSE = 45.0
+SATELLITES = {
+    "GP": (2, 5, 6, 9, 12, 17, 19, 24, 25, 29),
+    "GL": (65, 66, 72, 73, 80, 81, 87, 88),
+}
+
+
+def checksum_sentence(body: str) -> bytes:
+    """Complete sentence for `body` (the text between '$' and '*') including CRC and line ending"""
+    crc = 0
+    for char in body.encode():
+        crc ^= char
+    return f"${body}*{crc:02X}\r\n".encode()
+
+
+def corrupt_sentence(sentence: bytes, rng: random.Random) -> bytes:
+    """
+    Flip one bit in the body of a sentence, leaving its now wrong CRC in place. Flipping the top bit gives a
+    non-ASCII byte, as line noise does.
+    """
+    data = bytearray(sentence)
+    index = rng.randrange(1, data.index(b"*"))
+    data[index] ^= 1 << rng.randrange(8)
+    return bytes(data)
+
+
+def _coordinate(value: float, degree_digits: int) -> str:
+    value = abs(value)
+    degrees = int(value)
+    return f"{degrees:0{degree_digits}d}{(value - degrees) * 60:08.5f}"
+
+
+def _epoch_sentences(epoch: int, rate_hz: int, multi_constellation: bool) -> list[str]:
+    seconds = epoch / rate_hz
+    distance_deg = SPEED_KNOTS * 1.852 / 3600 * seconds / 111.32
+    latitude = START_LATITUDE + distance_deg * 0.7071
+    longitude = START_LONGITUDE + distance_deg * 0.7071
+
+    hours, rest = divmod(12 * 3600 + seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    utc = f"{int(hours):02d}{int(minutes):02d}{secs:05.2f}"
+    lat = f"{_coordinate(latitude, 2)},{'N' if latitude >= 0 else 'S'}"
+    lon = f"{_coordinate(longitude, 3)},{'E' if longitude >= 0 else 'W'}"
+    nav = "GN" if multi_constellation else "GP"
+    constellations = ("GP", "GL") if multi_constellation else ("GP",)
+    in_use = sum(len(SATELLITES[c]) for c in constellations)
+
+    sentences = [
+        f"{nav}RMC,{utc},A,{lat},{lon},{SPEED_KNOTS:.3f},{COURSE:.2f},180326,,,A",
+        f"{nav}GGA,{utc},{lat},{lon},1,{in_use:02d},0.92,35.4,M,-33.9,M,,",
+        f"{nav}VTG,{COURSE:.2f},T,,M,{SPEED_KNOTS:.3f},N,{SPEED_KNOTS * 1.852:.3f},K,A",
+    ]
+
+    if epoch % rate_hz == 0:
+        for talker in constellations:
+            prns = SATELLITES[talker]
+            used = ",".join(f"{prn:02d}" for prn in prns[:12])
+            sentences.append(
+                f"{talker}GSA,A,3,{used}{',' * (12 - len(prns[:12]))},1.60,0.92,1.31"
+            )
+
+            total = (len(prns) + 3) // 4
+            for number in range(total):
+                group = prns[number * 4 : number * 4 + 4]
+                sats = "".join(
+                    f",{prn:02d},{(prn * 7) % 90:02d},{(prn * 37) % 360:03d},{30 + prn % 20:02d}"
+                    for prn in group
+                )
+                sentences.append(
+                    f"{talker}GSV,{total},{number + 1},{len(prns):02d}{sats}"
+                )
+
+    return sentences
+
+
+def synthetic_stream(
+    rate_hz: int = 1,
+    seconds: int = 60,
+    multi_constellation: bool = False,
+    crc_error_rate: float = 0.0,
+    seed: int = 0,
+) -> bytes:
+    """Raw receiver output for `seconds` of riding at a `rate_hz` navigation rate. crc_error_rate is the
+    fraction of sentences corrupted in transit"""
+    rng = random.Random(seed)
+    out = bytearray()
+    for epoch in range(rate_hz * seconds):
+        for body in _epoch_sentences(epoch, rate_hz, multi_constellation):
+            sentence = checksum_sentence(body)
+            if crc_error_rate and rng.random() < crc_error_rate:
+                sentence = corrupt_sentence(sentence, rng)
+            out += sentence
+    return bytes(out)
+
+
+def load_stream(path: str) -> bytes:
+    """Recorded receiver output, e.g. captured with `mpremote` or a USB serial adapter"""
+    with open(path, "rb") as stream_file:
+        return stream_file.read()
+
+
+def chunks(data: bytes, size: int) -> Iterator[bytes]:
+    """Split a stream into reads of `size` bytes, as the UART hands them to GPSController"""
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+def count_sentences(data: bytes) -> int:
+    return data.count(b"$")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic NMEA stream")
+    parser.add_argument("--rate", type=int, default=1, help="navigation rate in Hz")
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument(
+        "--multi", action="store_true", help="GPS + GLONASS with GN talkers"
+    )
+    parser.add_argument(
+        "--crc-errors", type=float, default=0.0, help="fraction of corrupted sentences"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="output file, stdout if omitted")
+    args = parser.parse_args()
+
+    data = synthetic_stream(
+        args.rate, args.seconds, args.multi, args.crc_errors, args.seed
+    )
+    if args.output:
+        with open(args.output, "wb") as output:
+            output.write(data)
+    else:
+        sys.stdout.buffer.write(data)
+
+
+if __name__ == "__main__":
+    main()
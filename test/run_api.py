@@ -1,6 +1,11 @@
-from http.server import HTTPServer
+import argparse
+import threading
+import time
+from http.server import HTTPServer, ThreadingHTTPServer
 from typing import TypedDict
-from test.api_handler import APIHandler
+from test.api_handler import APIHandler, HTTPError
+from test.track_simplify import METHODS, simplify_rows
+from test.wire_format import encode_bike, encode_bikes, encode_fixes
 
 
 class BikeData(TypedDict):
@@ -40,23 +45,118 @@ SAMPLE_DATA: list[BikeData] = [
 # fmt: on
 
 API_PORT = 5001
+# The sample ride as served by /track, with ticks_ms() style timestamps TRACK_INTERVAL_MS apart (the sample
+# positions are ~11 m apart, about its 10 mph)
+TRACK_INTERVAL_MS = 2000
+TRACK_SATELLITES = 9
+FLEET_TICK = 1.0  # Seconds simulated per fleet step
+FLEET_MAX_TICKS = 60  # Steps caught up in one request after the server was idle
 
 
 class BikeServer:
-    def __init__(self):
+    def __init__(self, fleet_size: int = 0):
         self.data_index = 0
         self.sample_data = SAMPLE_DATA
+        self.track_fixes = [
+            {
+                "latitude": row["latitude"],
+                "longitude": row["longitude"],
+                "velocity": row["velocity"],
+                "satellites": TRACK_SATELLITES,
+                "timestamp": (index + 1) * TRACK_INTERVAL_MS,
+            }
+            for index, row in enumerate(SAMPLE_DATA)
+        ]
+        # Requests are handled on concurrent threads in threaded mode, each must get its own sample
+        self._index_lock = threading.Lock()
 
-        @APIHandler.get("/")
+        @APIHandler.get("/", binary=encode_bike)
         def index(_: dict) -> BikeData:
-            data = self.sample_data[self.data_index % len(self.sample_data)]
-            self.data_index += 1
-            return data
+            with self._index_lock:
+                index = self.data_index
+                self.data_index += 1
+            return self.sample_data[index % len(self.sample_data)]
 
-    def run(self, port: int):
-        print(f"Serving on http://localhost:{port}")
-        HTTPServer(("localhost", port), APIHandler).serve_forever()
+        @APIHandler.get("/track", binary=lambda result: encode_fixes(result["fixes"]))
+        def track(args: dict) -> dict:
+            """
+            The sample ride in the firmware's /track format: fixes newer than ?since=<timestamp> and the cursor
+            for the next poll, simplified with ?tolerance=<metres>[&method=dp|vw]
+            """
+            try:
+                since = int(args.get("since", 0))
+            except (TypeError, ValueError):
+                raise HTTPError(400, "since must be a timestamp")
+            fixes = [fix for fix in self.track_fixes if fix["timestamp"] > since]
+            cursor = fixes[-1]["timestamp"] if fixes else since
+
+            if "tolerance" in args:
+                try:
+                    tolerance = float(args["tolerance"])
+                except (TypeError, ValueError):
+                    raise HTTPError(400, "tolerance must be a number of metres")
+                method = args.get("method", "dp")
+                if method not in METHODS:
+                    raise HTTPError(400, f"method must be one of {', '.join(METHODS)}")
+                fixes = simplify_rows(fixes, tolerance, method)
+            return {"fixes": fixes, "cursor": cursor}
+
+        if fleet_size:
+            self._serve_fleet(fleet_size)
+
+    def _serve_fleet(self, size: int):
+        """Serves a simulated fleet under /bikes and /bikes/<id>, advanced in real time as it is requested"""
+        from test.fleet import Fleet
+
+        self.fleet = Fleet(size)
+        self._fleet_time = time.monotonic()
+        self._fleet_lock = threading.Lock()
+
+        def advance():
+            # Called with the fleet lock held
+            ticks = int((time.monotonic() - self._fleet_time) / FLEET_TICK)
+            for _ in range(min(ticks, FLEET_MAX_TICKS)):
+                self.fleet.tick(FLEET_TICK)
+            self._fleet_time += ticks * FLEET_TICK
+
+        @APIHandler.get("/bikes", binary=lambda result: encode_bikes(result["bikes"]))
+        def bikes(_: dict) -> dict:
+            with self._fleet_lock:
+                advance()
+                return {"bikes": self.fleet.bikes()}
+
+        @APIHandler.get("/bikes/<bike_id>", binary=encode_bike)
+        def bike(_: dict, bike_id: str) -> dict:
+            if not bike_id.isdigit() or int(bike_id) >= self.fleet.size:
+                raise HTTPError(404, f"no bike {bike_id}")
+            with self._fleet_lock:
+                advance()
+                return self.fleet.bike(int(bike_id))
+
+    def run(self, port: int, threaded: bool = False):
+        """Serve forever, one request at a time or, if `threaded`, each connection on its own thread"""
+        server_class = ThreadingHTTPServer if threaded else HTTPServer
+        print(
+            f"Serving on http://localhost:{port}" + (" (threaded)" if threaded else "")
+        )
+        server_class(("localhost", port), APIHandler).serve_forever()
 
 
 if __name__ == "__main__":
-    BikeServer().run(API_PORT)
+    parser = argparse.ArgumentParser(description="Serve sample bike data")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument(
+        "--threaded",
+        action="store_true",
+        help="handle each connection on its own thread so a stalled client doesn't block the others",
+    )
+    parser.add_argument(
+        "--fleet",
+        type=int,
+        default=0,
+        metavar="SIZE",
+        help="also serve a simulated fleet of SIZE bikes under /bikes and /bikes/<id>",
+    )
+    args = parser.parse_args()
+
+    BikeServer(args.fleet).run(args.port, args.threaded)
@@ -0,0 +1,215 @@
+"""
+Vectorised track analytics: distances, bearings, speeds and moving time for recorded positions.
+
+A track is a set of NumPy columns, one entry per fix. Logs from several bikes are handled in one pass: the fixes
+of each bike must be contiguous and in time order (see Track.sorted()), and every per-segment value is masked at
+the boundaries between bikes, so nothing is computed across two bikes.
+
+    track = Track.from_fixes(requests.get(f"{API}/track").json()["fixes"])
+    summary(track)
+"""
+
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+MPH_TO_MS = 0.44704
+# Slower segments count as stopped time (walking pace is ~1.4 m/s)
+STOPPED_BELOW_MS = 0.5
+
+
+class Track(NamedTuple):
+    latitude: np.ndarray  # Degrees
+    longitude: np.ndarray
+    time: np.ndarray  # Seconds
+    bike: np.ndarray  # Bike id of each fix
+
+    @classmethod
+    def from_arrays(cls, latitude, longitude, time, bike=None) -> "Track":
+        latitude = np.asarray(latitude, dtype=np.float64)
+        return cls(
+            latitude,
+            np.asarray(longitude, dtype=np.float64),
+            np.asarray(time, dtype=np.float64),
+            np.zeros(len(latitude), np.int64) if bike is None else np.asarray(bike),
+        )
+
+    @classmethod
+    def from_fixes(cls, fixes: Iterable[dict], bike: int = 0) -> "Track":
+        """Track from the firmware's /track fixes, whose timestamps are milliseconds"""
+        fixes = list(fixes)
+        return cls.from_arrays(
+            [fix["latitude"] for fix in fixes],
+            [fix["longitude"] for fix in fixes],
+            np.array([fix["timestamp"] for fix in fixes], dtype=np.float64) / 1000,
+            np.full(len(fixes), bike),
+        )
+
+    @classmethod
+    def from_bike_data(cls, rows: Iterable[dict], interval: float = 1.0) -> "Track":
+        """Track from BikeData rows (see test/run_api.py), which have no timestamps, sampled every `interval` s"""
+        rows = list(rows)
+        return cls.from_arrays(
+            [row["latitude"] for row in rows],
+            [row["longitude"] for row in rows],
+            np.arange(len(rows)) * interval,
+        )
+
+    def sorted(self) -> "Track":
+        """The track ordered by bike, then time"""
+        order = np.lexsort((self.time, self.bike))
+        return Track(*(column[order] for column in self))
+
+    def same_bike(self) -> np.ndarray:
+        """Per segment (fix i to i + 1), whether both fixes belong to the same bike"""
+        return self.bike[1:] == self.bike[:-1]
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in metres between arrays of points in degrees"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def segment_distances(track: Track) -> np.ndarray:
+    """Metres between consecutive fixes (length n - 1), 0 between the fixes of different bikes"""
+    distances = haversine(
+        track.latitude[:-1],
+        track.longitude[:-1],
+        track.latitude[1:],
+        track.longitude[1:],
+    )
+    distances[~track.same_bike()] = 0.0
+    return distances
+
+
+def cumulative_distance(track: Track) -> np.ndarray:
+    """Metres ridden up to each fix (length n), restarting at 0 for each bike"""
+    if not len(track.latitude):
+        return np.zeros(0)
+    distance = np.concatenate([[0.0], np.cumsum(segment_distances(track))])
+    return distance - distance[_group_starts(track)]
+
+
+def bearings(track: Track) -> np.ndarray:
+    """Initial bearing in degrees clockwise from north of each segment (length n - 1), NaN between bikes"""
+    lat1, lon1, lat2, lon2 = map(
+        np.radians,
+        (
+            track.latitude[:-1],
+            track.longitude[:-1],
+            track.latitude[1:],
+            track.longitude[1:],
+        ),
+    )
+    y = np.sin(lon2 - lon1) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+    result = np.degrees(np.arctan2(y, x)) % 360
+    result[~track.same_bike()] = np.nan
+    return result
+
+
+def segment_durations(track: Track) -> np.ndarray:
+    """Seconds between consecutive fixes (length n - 1), 0 between bikes"""
+    durations = np.diff(track.time)
+    durations[~track.same_bike()] = 0.0
+    return durations
+
+
+def speeds(track: Track, distances: Optional[np.ndarray] = None) -> np.ndarray:
+    """Speed of each segment in m/s (length n - 1), NaN between bikes and for fixes with the same time"""
+    if distances is None:
+        distances = segment_distances(track)
+    durations = segment_durations(track)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = distances / durations
+    result[durations <= 0] = np.nan
+    return result
+
+
+def smooth(
+    values: np.ndarray, window: int, groups: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Centered moving average over `window` samples, ignoring NaNs. With `groups` (a group id per value) the window
+    never crosses from one group into the next, and is truncated at group and array ends.
+    """
+    n = len(values)
+    half = window // 2
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+
+    index = np.arange(n)
+    low = np.maximum(index - half, 0)
+    high = np.minimum(index + half + 1, n)
+    if groups is not None:
+        starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+        group_of = np.cumsum(np.concatenate([[False], groups[1:] != groups[:-1]]))
+        ends = np.append(starts[1:], n)
+        low = np.maximum(low, starts[group_of])
+        high = np.minimum(high, ends[group_of])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sums[high] - sums[low]) / (counts[high] - counts[low])
+
+
+def smoothed_speeds(track: Track, window: int = 5) -> np.ndarray:
+    """Segment speeds in m/s smoothed over `window` segments of the same bike"""
+    return smooth(speeds(track), window, track.bike[:-1])
+
+
+def moving_time(
+    track: Track, threshold: float = STOPPED_BELOW_MS
+) -> tuple[np.ndarray, np.ndarray]:
+    """Per bike (in order of np.unique(track.bike)), seconds spent moving and seconds stopped"""
+    summed = _per_bike_totals(track, threshold)
+    return summed["moving_time"], summed["stopped_time"]
+
+
+def summary(track: Track, threshold: float = STOPPED_BELOW_MS) -> dict:
+    """Per bike totals: distance (m), moving and stopped time (s) and average moving speed (mph)"""
+    if len(track.time) < 2:
+        return {}
+    totals = _per_bike_totals(track, threshold)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average_ms = totals["moving_distance"] / totals["moving_time"]
+    average_mph = np.where(totals["moving_time"] > 0, average_ms, 0.0) / MPH_TO_MS
+
+    return {
+        bike.item(): {
+            "distance": totals["distance"][i].item(),
+            "moving_time": totals["moving_time"][i].item(),
+            "stopped_time": totals["stopped_time"][i].item(),
+            "average_speed": average_mph[i].item(),
+        }
+        for i, bike in enumerate(totals["bikes"])
+    }
+
+
+def _per_bike_totals(track: Track, threshold: float) -> dict:
+    bikes = np.unique(track.bike)
+    bike_index = np.searchsorted(bikes, track.bike[:-1])
+    distances = segment_distances(track)
+    durations = segment_durations(track)
+    # NaN speeds compare False, so segments without a duration count as stopped
+    moving = speeds(track, distances) >= threshold
+    return {
+        "bikes": bikes,
+        "distance": np.bincount(bike_index, distances, len(bikes)),
+        "moving_distance": np.bincount(bike_index, distances * moving, len(bikes)),
+        "moving_time": np.bincount(bike_index, durations * moving, len(bikes)),
+        "stopped_time": np.bincount(bike_index, durations * ~moving, len(bikes)),
+    }
+
+
+def _group_starts(track: Track) -> np.ndarray:
+    """For every fix, the index of the first fix of its bike"""
+    new_bike = np.concatenate([[True], ~track.same_bike()])
+    return np.maximum.accumulate(np.where(new_bike, np.arange(len(new_bike)), 0))
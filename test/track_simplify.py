@@ -0,0 +1,153 @@
+"""
+Track simplification to a tolerance in metres, to cut the number of points sent to and drawn by the map.
+
+  - douglas_peucker() keeps every point further than the tolerance from the simplified line, the best fit for a
+    given tolerance.
+  - visvalingam() repeatedly drops the point forming the smallest triangle with its neighbours until every
+    remaining triangle is at least tolerance² in area, which keeps the overall shape smoother.
+
+Positions are projected to metres on a local equirectangular plane, accurate to well under a metre over the few
+kilometres of a ride.
+"""
+
+import heapq
+
+import numpy as np
+
+from test.track_analytics import Track
+
+METERS_PER_DEG_LAT = 111320.0
+
+
+def _project(
+    latitude: np.ndarray, longitude: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Metres east and north of the first point"""
+    east = (
+        (longitude - longitude[0])
+        * METERS_PER_DEG_LAT
+        * np.cos(np.radians(latitude[0]))
+    )
+    north = (latitude - latitude[0]) * METERS_PER_DEG_LAT
+    return east, north
+
+
+def douglas_peucker(latitude, longitude, tolerance: float) -> np.ndarray:
+    """Mask of the points kept by Douglas-Peucker with a `tolerance` in metres"""
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    n = len(latitude)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[[0, -1]] = True
+    x, y = _project(latitude, longitude)
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        # Distance of the points in between to the segment start-end, vectorised over the whole range
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1 : end] - x[start], y[start + 1 : end] - y[start]
+        length2 = dx * dx + dy * dy
+        if length2 > 0:
+            t = np.clip((px * dx + py * dy) / length2, 0.0, 1.0)
+            px, py = px - t * dx, py - t * dy
+        distances = np.hypot(px, py)
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return keep
+
+
+def visvalingam(latitude, longitude, tolerance: float) -> np.ndarray:
+    """Mask of the points kept by Visvalingam-Whyatt, dropping triangles smaller than tolerance² m²"""
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    n = len(latitude)
+    keep = np.ones(n, dtype=bool)
+    if n < 3:
+        return keep
+    x, y = _project(latitude, longitude)
+    threshold = tolerance * tolerance
+
+    def area(before, point, after):
+        return (
+            abs(
+                (x[before] - x[point]) * (y[after] - y[point])
+                - (x[after] - x[point]) * (y[before] - y[point])
+            )
+            / 2
+        )
+
+    previous = list(range(-1, n - 1))
+    following = list(range(1, n + 1))
+    # Initial areas of all interior points at once, the heap is then updated as neighbours are removed
+    areas = (
+        np.abs(
+            (x[:-2] - x[1:-1]) * (y[2:] - y[1:-1])
+            - (x[2:] - x[1:-1]) * (y[:-2] - y[1:-1])
+        )
+        / 2
+    )
+    current = np.concatenate([[np.inf], areas, [np.inf]])
+    heap = [(a, i) for i, a in enumerate(areas.tolist(), 1)]
+    heapq.heapify(heap)
+
+    while heap:
+        point_area, point = heapq.heappop(heap)
+        if point_area >= threshold:
+            break
+        if not keep[point] or point_area != current[point]:
+            continue  # Removed already, or a stale entry from before a neighbour was removed
+
+        keep[point] = False
+        before, after = previous[point], following[point]
+        following[before] = after
+        previous[after] = before
+
+        # The neighbours' triangles change. An area never drops below the one just removed, so points
+        # are removed in order of their effective area
+        for neighbour in (before, after):
+            if 0 < neighbour < n - 1:
+                new_area = max(
+                    area(previous[neighbour], neighbour, following[neighbour]),
+                    point_area,
+                )
+                current[neighbour] = new_area
+                heapq.heappush(heap, (new_area, neighbour))
+
+    return keep
+
+
+METHODS = {"dp": douglas_peucker, "vw": visvalingam}
+
+
+def simplify(track: Track, tolerance: float, method: str = "dp") -> Track:
+    """The track reduced to `tolerance` metres, each bike simplified separately"""
+    simplifier = METHODS[method]
+    keep = np.zeros(len(track.time), dtype=bool)
+    boundaries = np.flatnonzero(np.concatenate([[True], ~track.same_bike(), [True]]))
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        keep[start:end] = simplifier(
+            track.latitude[start:end], track.longitude[start:end], tolerance
+        )
+    return Track(*(column[keep] for column in track))
+
+
+def simplify_rows(rows: list, tolerance: float, method: str = "dp") -> list:
+    """The subset of position dicts (e.g. BikeData or /track fixes) kept by simplification"""
+    if not rows:
+        return rows
+    latitude = np.array([row["latitude"] for row in rows], dtype=np.float64)
+    longitude = np.array([row["longitude"] for row in rows], dtype=np.float64)
+    keep = METHODS[method](latitude, longitude, tolerance)
+    return [row for row, kept in zip(rows, keep.tolist()) if kept]
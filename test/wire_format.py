@@ -0,0 +1,232 @@
+"""
+Host side of the binary wire format: decoders for the firmware's packed fix records (layout documented in
+firmware/esp32/wire_format.py) and the bike records served by the host API for ?fmt=bin or
+`Accept: application/octet-stream`.
+
+A bike record is 16 bytes, little-endian ("<IiiHH"):
+
+    offset  type    field
+    0       uint32  bike id (0 for the single sample bike)
+    4       int32   latitude, microdegrees
+    8       int32   longitude, microdegrees
+    12      uint16  velocity, hundredths of a mph
+    14      uint16  battery, hundredths of a percent
+
+GET /, GET /bikes/<id> return one record, GET /bikes consecutive records. The host GET /track serves the
+firmware's fix records, packed by encode_fixes().
+
+The firmware's GET /history?fmt=bin returns fix log records as stored on the tracker (layout documented in
+firmware/esp32/fix_log.py), decoded by decode_log_records().
+
+Delta encoded tracks (the firmware's GET /track?fmt=delta) can additionally be zlib compressed for archiving,
+decode_track_delta() accepts either:
+
+    python3 -m test.wire_format http://10.0.0.54:5001 ride.trz   # download, compress and save a track
+    python3 -m test.wire_format ride.trz                         # print it as JSON
+"""
+
+import argparse
+import json
+import struct
+import sys
+import urllib.request
+import zlib
+
+FIX_FORMAT = struct.Struct("<iiHBBI")
+BIKE_FORMAT = struct.Struct("<IiiHH")
+LOG_FORMAT = struct.Struct("<IiiHBB")
+CONTENT_TYPE = "application/octet-stream"
+
+DELTA_VERSION = 1
+TICKS_PERIOD = 1 << 30
+# Seconds from the unix epoch to the MicroPython epoch (2000-01-01) of fix log times
+UNIX_EPOCH_OFFSET = 946684800
+
+
+def decode_fixes(data: bytes) -> list[dict]:
+    """Fixes from a firmware GET / or GET /track binary response, in the JSON responses' units"""
+    return [
+        {
+            "latitude": latitude / 1000000,
+            "longitude": longitude / 1000000,
+            "velocity": velocity / 100,
+            "satellites": satellites,
+            "timestamp": timestamp,
+        }
+        for latitude, longitude, velocity, satellites, _, timestamp in FIX_FORMAT.iter_unpack(
+            data
+        )
+    ]
+
+
+def decode_log_records(data: bytes) -> list[dict]:
+    """Fixes from a firmware GET /history binary response, as in its JSON response (unix times)"""
+    return [
+        {
+            "latitude": latitude / 1000000,
+            "longitude": longitude / 1000000,
+            "velocity": velocity / 100,
+            "satellites": satellites,
+            "time": time + UNIX_EPOCH_OFFSET,
+        }
+        for time, latitude, longitude, velocity, satellites, _ in LOG_FORMAT.iter_unpack(
+            data
+        )
+    ]
+
+
+def decode_bikes(data: bytes) -> list[dict]:
+    """Bikes from a host API binary response"""
+    return [
+        {
+            "id": bike_id,
+            "latitude": latitude / 1000000,
+            "longitude": longitude / 1000000,
+            "velocity": velocity / 100,
+            "battery": battery / 100,
+        }
+        for bike_id, latitude, longitude, velocity, battery in BIKE_FORMAT.iter_unpack(
+            data
+        )
+    ]
+
+
+def encode_bikes(bikes: list) -> bytes:
+    """Packed bike records for BikeData-like dicts, those without an id are bike 0"""
+    records = bytearray(BIKE_FORMAT.size * len(bikes))
+    for index, bike in enumerate(bikes):
+        BIKE_FORMAT.pack_into(
+            records,
+            index * BIKE_FORMAT.size,
+            bike.get("id", 0),
+            round(bike["latitude"] * 1000000),
+            round(bike["longitude"] * 1000000),
+            min(round(bike["velocity"] * 100), 0xFFFF),
+            min(round(bike["battery"] * 100), 0xFFFF),
+        )
+    return bytes(records)
+
+
+def encode_bike(bike: dict) -> bytes:
+    return encode_bikes([bike])
+
+
+def encode_fixes(fixes: list) -> bytes:
+    """Packed fix records for /track fixes, the inverse of decode_fixes()"""
+    records = bytearray(FIX_FORMAT.size * len(fixes))
+    for index, fix in enumerate(fixes):
+        FIX_FORMAT.pack_into(
+            records,
+            index * FIX_FORMAT.size,
+            round(fix["latitude"] * 1000000),
+            round(fix["longitude"] * 1000000),
+            min(round(fix["velocity"] * 100), 0xFFFF),
+            fix["satellites"],
+            0,
+            fix["timestamp"] % TICKS_PERIOD,
+        )
+    return bytes(records)
+
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def _varints(data: bytes, offset: int):
+    value = shift = 0
+    for byte in data[offset:]:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            yield value
+            value = shift = 0
+    if shift:
+        raise ValueError("truncated delta record")
+
+
+def encode_track_delta(fixes: list, compress: bool = False) -> bytes:
+    """Delta encoded track for fixes as decoded by decode_fixes(), zlib compressed if `compress`"""
+    out = bytearray([DELTA_VERSION])
+    latitude = longitude = timestamp = 0
+    for fix in fixes:
+        fix_latitude = round(fix["latitude"] * 1000000)
+        fix_longitude = round(fix["longitude"] * 1000000)
+        d_time = (fix["timestamp"] - timestamp + TICKS_PERIOD // 2) % TICKS_PERIOD
+        for value in (
+            _zigzag(fix_latitude - latitude),
+            _zigzag(fix_longitude - longitude),
+            _zigzag(d_time - TICKS_PERIOD // 2),
+            round(fix["velocity"] * 100),
+            fix["satellites"],
+        ):
+            while value > 0x7F:
+                out.append((value & 0x7F) | 0x80)
+                value >>= 7
+            out.append(value)
+        latitude, longitude, timestamp = fix_latitude, fix_longitude, fix["timestamp"]
+
+    return zlib.compress(bytes(out), 9) if compress else bytes(out)
+
+
+def decode_track_delta(data: bytes) -> list[dict]:
+    """Fixes from a delta encoded track, optionally zlib compressed, in the JSON responses' units"""
+    if data[:1] != bytes([DELTA_VERSION]):
+        data = zlib.decompress(data)
+    if data[:1] != bytes([DELTA_VERSION]):
+        raise ValueError("not a delta encoded track")
+
+    fixes = []
+    latitude = longitude = timestamp = 0
+    values = _varints(data, 1)
+    for d_lat, d_lon, d_time, velocity, satellites in zip(*[values] * 5):
+        latitude += _unzigzag(d_lat)
+        longitude += _unzigzag(d_lon)
+        timestamp = (timestamp + _unzigzag(d_time)) % TICKS_PERIOD
+        fixes.append(
+            {
+                "latitude": latitude / 1000000,
+                "longitude": longitude / 1000000,
+                "velocity": velocity / 100,
+                "satellites": satellites,
+                "timestamp": timestamp,
+            }
+        )
+    return fixes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Download or print delta encoded tracks"
+    )
+    parser.add_argument("source", help="tracker URL to download from, or a saved track")
+    parser.add_argument(
+        "output", nargs="?", help="file to save the downloaded track to"
+    )
+    parser.add_argument("--since", type=int, help="only fixes after this timestamp")
+    parser.add_argument("--raw", action="store_true", help="save without compressing")
+    args = parser.parse_args()
+
+    if args.source.startswith("http"):
+        url = args.source.rstrip("/") + "/track?fmt=delta"
+        if args.since is not None:
+            url += f"&since={args.since}"
+        with urllib.request.urlopen(url) as response:
+            data = response.read()
+        if args.output:
+            with open(args.output, "wb") as output:
+                output.write(data if args.raw else zlib.compress(data, 9))
+            print(f"{len(decode_track_delta(data))} fixes, {len(data)} bytes")
+            return
+    else:
+        with open(args.source, "rb") as source:
+            data = source.read()
+
+    json.dump(decode_track_delta(data), sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+    main()